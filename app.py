@@ -1,21 +1,54 @@
 """Flask application for AI Product Search"""
-from flask import Flask, render_template, jsonify, request, Response, stream_with_context, send_from_directory
+from flask import Flask, jsonify, request, Response, stream_with_context, send_from_directory
+from flask.json.provider import DefaultJSONProvider, JSONProvider
 from flask_cors import CORS
-import json
+import hashlib
 import os
+import threading
+import time
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache, wraps
+from operator import itemgetter
 from config import Config
 import httpx
+import numpy as np
+import orjson
 from urllib.parse import unquote
 import os
 from product_indexer import ProductIndexer
 from search_engine import SearchEngine
 
+_ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+
+
+def _json_bytes(obj):
+    """Encode obj the way jsonify does: orjson, with Flask's fallback for other types"""
+    return orjson.dumps(obj, default=DefaultJSONProvider.default, option=_ORJSON_OPTIONS)
+
+
+class OrjsonProvider(JSONProvider):
+    """Flask JSON provider backed by orjson (used by jsonify and request.get_json)"""
+    
+    def dumps(self, obj, **kwargs):
+        return _json_bytes(obj).decode()
+    
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+    
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(_json_bytes(obj), mimetype='application/json')
+
+
 # Initialize Flask app
 app = Flask(__name__)
 app.config.from_object(Config)
+app.json = OrjsonProvider(app)
 
 from db import db
 from epd_api import epd_bp
+from rule_engine import evaluate_product
 
 # Initialize configuration
 Config.init_app()
@@ -26,86 +59,205 @@ db.init_app(app)
 
 with app.app_context():
     db.create_all()
+    # create_all skips existing tables, so add indexes introduced since they were created
+    for table in db.metadata.sorted_tables:
+        for table_index in table.indexes:
+            table_index.create(db.engine, checkfirst=True)
 
 # Register blueprints
 app.register_blueprint(epd_bp)
 
+# Default sorting for assessed products: risk(red,yellow,green) -> no EPD first -> name
+RISK_ORDER = {'red': 0, 'yellow': 1, 'green': 2}
+
+
+@lru_cache(maxsize=8192)
+def _assess_record(product_id, product_name, manufacturer, epd_url, epd_issue_date):
+    """
+    Evaluate one canonicalized product and return (sort_key, record).
+    The result is shared across requests, do not mutate.
+    """
+    risk, reasons, _ = evaluate_product({'epd_url': epd_url, 'epd_issue_date': epd_issue_date})
+    risk_level = risk.lower()
+    has_epd = bool((epd_url or '').strip())
+    record = {
+        'product_id': product_id,
+        'product_name': product_name,
+        'manufacturer': manufacturer,
+        'has_epd': has_epd,
+        'epd_url': epd_url,
+        'has_issue_date': bool((epd_issue_date or '').strip()),
+        'risk_level': risk_level,
+        'risk_reason': '；'.join(reasons) if reasons else ''
+    }
+    # False (no EPD) sorts before True
+    sort_key = (RISK_ORDER.get(risk_level, 3), has_epd, (product_name or '').lower())
+    return sort_key, record
+
+
+def _assess(p):
+    key = (
+        p.get('id') or p.get('product_id'),
+        p.get('product_name') or p.get('name'),
+        p.get('manufacturer_name') or p.get('manufacturer'),
+        p.get('epd_url'),
+        p.get('epd_issue_date'),
+    )
+    try:
+        return _assess_record(*key)
+    except TypeError:
+        # Unhashable field values (lists/dicts) cannot be cached
+        return _assess_record.__wrapped__(*key)
+
+
 # Lightweight JSON assessment endpoint (accepts arbitrary product dicts)
 @app.post('/api/assess-products')
 def assess_products():
     try:
-        from rule_engine import evaluate_product
         data = request.get_json() or {}
         products = data.get('products', [])
-        assessed = []
-        for p in products:
-            risk, reasons, advisories = evaluate_product(p)
-            has_epd = bool((p.get('epd_url') or '').strip())
-            assessed.append({
-                'product_id': p.get('id') or p.get('product_id'),
-                'product_name': p.get('product_name') or p.get('name'),
-                'manufacturer': p.get('manufacturer_name') or p.get('manufacturer'),
-                'has_epd': has_epd,
-                'epd_url': p.get('epd_url'),
-                'has_issue_date': bool((p.get('epd_issue_date') or '').strip()),
-                'risk_level': risk.lower(),
-                'risk_reason': '；'.join(reasons) if reasons else ''
-            })
-
-        # Default sorting: risk(red,yellow,green) -> no EPD first -> name
-        risk_order = {'red': 0, 'yellow': 1, 'green': 2}
-        assessed.sort(key=lambda x: (
-            risk_order.get(x['risk_level'], 3),
-            (not x['has_epd']) is False,  # False (no EPD) should come first => key False before True
-            (x.get('product_name') or '').lower()
-        ))
+        assess = _assess
+        keyed = [assess(p) for p in products]
+        keyed.sort(key=itemgetter(0))
+        assessed = [record for _, record in keyed]
 
+        counts = Counter(a['risk_level'] for a in assessed)
         return jsonify({
             'success': True,
             'products': assessed,
             'summary': {
                 'total': len(assessed),
-                'red': sum(1 for a in assessed if a['risk_level'] == 'red'),
-                'yellow': sum(1 for a in assessed if a['risk_level'] == 'yellow'),
-                'green': sum(1 for a in assessed if a['risk_level'] == 'green')
+                'red': counts['red'],
+                'yellow': counts['yellow'],
+                'green': counts['green']
             }
         })
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
+
+def stream_json_products(products, meta):
+    """
+    Stream {"success": true, "results": [...], **meta} one product at a time
+    instead of serializing the whole page in a single jsonify call.
+    """
+    # Encode the first product and meta before the response starts, so an encoding
+    # error still reaches the caller's error handling instead of truncating the body
+    head = b'{"success":true,"results":[' + (_json_bytes(products[0]) if products else b'')
+    tail = b'],' + _json_bytes(meta)[1:]
+    
+    def generate():
+        yield head
+        for i in range(1, len(products)):
+            yield b',' + _json_bytes(products[i])
+        yield tail
+    
+    return Response(generate(), mimetype='application/json')
+
+
 # Global variables for indexer and search engine
 indexer = None
 search_engine = None
+_init_lock = threading.Lock()
+_initialized = False
+# Last initialization failure, re-raised without reloading until the retry interval passes
+_init_error = None
+_init_failed_at = 0.0
+_INIT_RETRY_SECONDS = 60
 
 
 def init_search_system():
-    """Initialize the product indexer and search engine"""
-    global indexer, search_engine
+    """
+    Initialize the product indexer and search engine (once per process).
+    Raises the initialization error; a failed load is retried at most every
+    _INIT_RETRY_SECONDS.
+    """
+    global indexer, search_engine, _initialized, _init_error, _init_failed_at
+    
+    if _initialized:
+        return
     
-    if indexer is None:
-        print("Initializing search system...")
-        indexer = ProductIndexer(api_key=Config.OPENAI_API_KEY)
-        indexer.load_products()
+    with _init_lock:
+        # Another request may have finished initialization while we waited
+        if _initialized:
+            return
+        if _init_error is not None and time.monotonic() - _init_failed_at < _INIT_RETRY_SECONDS:
+            raise _init_error
         
-        # Generate embeddings (will use cache if available)
         try:
-            indexer.generate_embeddings()
+            print("Initializing search system...")
+            new_indexer = ProductIndexer(api_key=Config.OPENAI_API_KEY)
+            new_indexer.load_products()
+            
+            # Generate embeddings (will use cache if available)
+            try:
+                new_indexer.generate_embeddings()
+            except Exception as e:
+                print(f"Warning: Could not generate embeddings: {e}")
+                print("Search functionality will be limited without embeddings.")
+            
+            indexer = new_indexer
+            search_engine = SearchEngine(indexer, api_key=Config.OPENAI_API_KEY)
+            _build_catalog_responses()
         except Exception as e:
-            print(f"Warning: Could not generate embeddings: {e}")
-            print("Search functionality will be limited without embeddings.")
-        
-        search_engine = SearchEngine(indexer, api_key=Config.OPENAI_API_KEY)
+            print(f"Search system initialization failed: {e}")
+            _init_error, _init_failed_at = e, time.monotonic()
+            raise
+        _initialized = True
+        _init_error = None
         print("Search system initialized!")
 
 
+def requires_search_system(view):
+    """Initialize the search system before the view runs; answer 503 with the cause if it is unavailable"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if not _initialized:
+            try:
+                init_search_system()
+            except Exception as e:
+                return jsonify({'error': f'Search system unavailable: {e}'}), 503
+        return view(*args, **kwargs)
+    return wrapper
+
+
+# Serialized bodies + ETags for endpoints that only change when the catalog is reloaded
+_catalog_responses = {}
+
+
+def _build_catalog_responses():
+    # indexer.filter_indexes['certifications'] is a set of names
+    cert_names = sorted(indexer.filter_indexes.get('certifications', []))
+    payloads = {
+        'filters': indexer.get_filter_options(),
+        'certifications': {'count': len(cert_names), 'names': cert_names},
+        'stats': indexer.get_statistics(),
+    }
+    for name, payload in payloads.items():
+        body = _json_bytes(payload)
+        _catalog_responses[name] = (body, hashlib.sha256(body).hexdigest())
+
+
+def _catalog_response(name):
+    """Serve a precomputed catalog payload, answering 304 when the client's ETag matches"""
+    body, etag = _catalog_responses[name]
+    if etag in request.if_none_match:
+        response = Response(status=304)
+    else:
+        response = Response(body, mimetype='application/json')
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'public, max-age=300'
+    return response
+
+
 @app.route('/')
 def index():
-    """Main dashboard page"""
-    init_search_system()
-    return render_template('dashboard.html')
+    """Main dashboard page (static HTML, sent as a file rather than rendered)"""
+    return send_from_directory(app.template_folder, 'dashboard.html', max_age=60)
 
 
 @app.route('/api/products')
+@requires_search_system
 def get_all_products():
     """
     Get all products with optional filtering (no search query needed).
@@ -126,8 +278,6 @@ def get_all_products():
         }
     """
     try:
-        init_search_system()
-        
         # Get filter parameters
         filters = {}
         
@@ -148,18 +298,12 @@ def get_all_products():
         limit = int(request.args.get('limit', 100))
         
         # Get filtered products
-        all_products = indexer.products
-        filtered_products = []
-        
-        for product in all_products:
-            if search_engine._passes_filters(product, filters):
-                filtered_products.append(product)
-                if len(filtered_products) >= limit:
-                    break
+        # Rejected rows never reach Python; the limit is just a slice of the match indices
+        products = indexer.products
+        idx = np.flatnonzero(indexer.filter_mask(filters))[:max(limit, 1)]
+        filtered_products = [products[i] for i in idx.tolist()]
         
-        return jsonify({
-            'success': True,
-            'results': filtered_products,
+        return stream_json_products(filtered_products, {
             'count': len(filtered_products),
             'total': len(indexer.products)
         })
@@ -170,6 +314,7 @@ def get_all_products():
 
 
 @app.route('/api/search', methods=['POST'])
+@requires_search_system
 def search():
     """
     Search endpoint using hybrid AI search with optional filtering and pagination.
@@ -201,8 +346,6 @@ def search():
         }
     """
     try:
-        init_search_system()
-        
         data = request.get_json()
         if not data:
             return jsonify({'error': 'No data provided'}), 400
@@ -215,25 +358,18 @@ def search():
         
         # If no query, just return filtered products
         if not query:
-            all_products = indexer.products
-            filtered_products = []
-            
-            for product in all_products:
-                if filters and not search_engine._passes_filters(product, filters):
-                    continue
-                filtered_products.append(product)
+            matches = np.flatnonzero(indexer.filter_mask(filters))
             
-            # Paginate
-            total = len(filtered_products)
+            # Paginate over match indices so only the requested page is materialized
+            total = len(matches)
             total_pages = (total + per_page - 1) // per_page
             start_idx = (page - 1) * per_page
             end_idx = start_idx + per_page
-            paginated_products = filtered_products[start_idx:end_idx]
+            products = indexer.products
+            paginated_products = [products[i] for i in matches[start_idx:end_idx].tolist()]
             
-            return jsonify({
-                'success': True,
+            return stream_json_products(paginated_products, {
                 'query': '',
-                'results': paginated_products,
                 'count': len(paginated_products),
                 'total': total,
                 'page': page,
@@ -269,6 +405,7 @@ def search():
 
 
 @app.route('/api/products/<int:product_id>')
+@requires_search_system
 def get_product(product_id):
     """
     Get detailed information for a specific product.
@@ -277,8 +414,6 @@ def get_product(product_id):
         Product object with all details
     """
     try:
-        init_search_system()
-        
         product = indexer.get_product_by_id(product_id)
         if not product:
             return jsonify({'error': 'Product not found'}), 404
@@ -290,13 +425,13 @@ def get_product(product_id):
 
 
 @app.get('/api/product')
+@requires_search_system
 def get_product_flexible():
     """
     Get product details by a flexible identifier.
     Accepts query param 'id' which can be a numeric id or other known id fields.
     """
     try:
-        init_search_system()
         raw_id = (request.args.get('id') or '').strip()
         if not raw_id:
             return jsonify({'error': 'Missing id'}), 400
@@ -311,16 +446,7 @@ def get_product_flexible():
 
         # Fallback: match against common id-like fields
         if not product:
-            for p in indexer.products:
-                candidates = [
-                    str(p.get('id')) if p.get('id') is not None else '',
-                    str(p.get('product_id') or ''),
-                    str(p.get('sku') or ''),
-                    str(p.get('code') or ''),
-                ]
-                if raw_id in candidates:
-                    product = p
-                    break
+            product = indexer.by_any_id.get(raw_id)
 
         if not product:
             return jsonify({'error': 'Product not found'}), 404
@@ -331,6 +457,7 @@ def get_product_flexible():
 
 
 @app.route('/api/filters')
+@requires_search_system
 def get_filters():
     """
     Get available filter options for the UI.
@@ -343,28 +470,24 @@ def get_filters():
         }
     """
     try:
-        init_search_system()
-        
-        filter_options = indexer.get_filter_options()
-        return jsonify(filter_options)
+        return _catalog_response('filters')
     
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 
 @app.route('/api/certifications')
+@requires_search_system
 def get_certification_types():
     """List distinct certification names present in dataset."""
     try:
-        init_search_system()
-        # indexer.filter_indexes['certifications'] is a set of names
-        names = sorted(list(indexer.filter_indexes.get('certifications', [])))
-        return jsonify({'count': len(names), 'names': names})
+        return _catalog_response('certifications')
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 
 @app.route('/api/stats')
+@requires_search_system
 def get_stats():
     """
     Get product database statistics for dashboard.
@@ -373,16 +496,21 @@ def get_stats():
         Statistics about products, categories, manufacturers, etc.
     """
     try:
-        init_search_system()
-        
-        stats = indexer.get_statistics()
-        return jsonify(stats)
+        return _catalog_response('stats')
     
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 
+# Preformatted Server-Sent Events framing for /api/chat
+_SSE_START = b'data: {"type":"start"}\n\n'
+_SSE_DONE = b'data: {"type":"done"}\n\n'
+_SSE_CONTENT_PREFIX = b'data: {"type":"content","text":'
+_SSE_SUFFIX = b'}\n\n'
+
+
 @app.route('/api/chat', methods=['POST'])
+@requires_search_system
 def chat():
     """
     Conversational AI for product recommendations (streaming).
@@ -397,8 +525,6 @@ def chat():
         Server-Sent Events stream with AI response
     """
     try:
-        init_search_system()
-        
         data = request.get_json()
         if not data or 'query' not in data:
             return jsonify({'error': 'No query provided'}), 400
@@ -410,17 +536,17 @@ def chat():
             """Generate streaming response"""
             try:
                 # Send start event
-                yield f"data: {json.dumps({'type': 'start'})}\n\n"
+                yield _SSE_START
                 
-                # Stream AI response
+                # Stream AI response; only the chunk itself needs JSON encoding
                 for chunk in search_engine.stream_chat(query, history):
-                    yield f"data: {json.dumps({'type': 'content', 'text': chunk})}\n\n"
+                    yield _SSE_CONTENT_PREFIX + orjson.dumps(chunk) + _SSE_SUFFIX
                 
                 # Send done event
-                yield f"data: {json.dumps({'type': 'done'})}\n\n"
+                yield _SSE_DONE
             
             except Exception as e:
-                yield f"data: {json.dumps({'type': 'error', 'message': str(e)})}\n\n"
+                yield b'data: ' + orjson.dumps({'type': 'error', 'message': str(e)}) + b'\n\n'
         
         return Response(
             stream_with_context(generate()),
@@ -436,6 +562,7 @@ def chat():
 
 
 @app.route('/api/similar/<int:product_id>')
+@requires_search_system
 def get_similar_products(product_id):
     """
     Find products similar to a given product.
@@ -444,20 +571,12 @@ def get_similar_products(product_id):
         List of similar products
     """
     try:
-        init_search_system()
-        
-        product = indexer.get_product_by_id(product_id)
-        if not product:
+        product_idx = indexer.row_by_id.get(product_id)
+        if product_idx is None:
             return jsonify({'error': 'Product not found'}), 404
         
-        # Create a search query from the product
-        query = f"{product.get('product_name', '')} {product.get('product_description', '')}"
-        
-        # Search for similar products
-        results = search_engine.semantic_search(query, top_k=11)
-        
-        # Filter out the original product
-        similar = [r for r in results if r['id'] != product_id][:10]
+        # Rank against the product's own embedding (no API round-trip)
+        similar = search_engine.similar_products(product_idx, top_k=10)
         
         return jsonify({
             'product_id': product_id,
@@ -474,7 +593,6 @@ def health_check():
     """Health check endpoint"""
     try:
         init_search_system()
-        
         return jsonify({
             'status': 'healthy',
             'products_loaded': len(indexer.products),
@@ -488,6 +606,197 @@ def health_check():
         }), 500
 
 
+# Shared HTTP client so image proxying reuses pooled keep-alive connections
+_IMAGE_MAX_CONNECTIONS = 32
+_image_client = httpx.Client(
+    follow_redirects=True,
+    timeout=10,
+    limits=httpx.Limits(max_connections=_IMAGE_MAX_CONNECTIONS, max_keepalive_connections=_IMAGE_MAX_CONNECTIONS)
+)
+
+# Fallback candidates are probed in this pool while the request thread probes the first
+# one. The pool has its own client, sized to its workers, so fallbacks never take
+# connections the request threads are waiting for
+_IMAGE_FALLBACK_CONNECTIONS = 16
+_image_fallback_client = httpx.Client(
+    follow_redirects=True,
+    timeout=10,
+    limits=httpx.Limits(max_connections=_IMAGE_FALLBACK_CONNECTIONS, max_keepalive_connections=_IMAGE_FALLBACK_CONNECTIONS)
+)
+_image_probe_pool = ThreadPoolExecutor(max_workers=_IMAGE_FALLBACK_CONNECTIONS, thread_name_prefix='image-probe')
+
+
+def _probe_image(url, client=None, cancelled=None):
+    """
+    Return (content_type, bytes) if url serves an image, otherwise None.
+    Stops early, before the request or between body chunks, once cancelled is set.
+    Raises httpx.PoolTimeout when no connection frees up, so a busy proxy is not reported as a miss.
+    """
+    try:
+        if cancelled is not None and cancelled.is_set():
+            return None
+        with (client or _image_client).stream('GET', url) as r:
+            if r.status_code != 200:
+                return None
+            ct = r.headers.get('content-type', 'application/octet-stream')
+            if not ct.startswith('image/'):
+                return None
+            chunks = []
+            for chunk in r.iter_bytes():
+                if cancelled is not None and cancelled.is_set():
+                    return None
+                chunks.append(chunk)
+        return ct, b''.join(chunks)
+    except httpx.PoolTimeout:
+        raise
+    except Exception:
+        return None
+
+
+def _image_cache_path(clean):
+    return os.path.join(Config.PROXY_CACHE_DIR, hashlib.sha1(clean.encode('utf-8')).hexdigest())
+
+
+def _read_cached_image(clean):
+    path = _image_cache_path(clean)
+    try:
+        with open(path, 'rb') as f:
+            ct, content = f.read().split(b'\n', 1)
+    except (OSError, ValueError):
+        return None
+    try:
+        # Eviction goes by mtime, so a hit marks the file as recently used
+        os.utime(path)
+    except OSError:
+        pass
+    return ct.decode('ascii'), content
+
+
+# Bytes this process believes the disk cache holds (None until the first write scans it)
+_disk_cache_bytes = None
+_disk_cache_lock = threading.Lock()
+
+
+def _prune_disk_cache():
+    """Delete the least recently used cached images until the cache is under 90% of its limit; return its size"""
+    entries = []
+    for entry in os.scandir(Config.PROXY_CACHE_DIR):
+        if entry.name.endswith('.tmp'):
+            continue
+        try:
+            stat = entry.stat()
+        except OSError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, entry.path))
+    total = sum(size for _, size, _ in entries)
+    if total <= Config.PROXY_CACHE_MAX_BYTES:
+        return total
+    entries.sort()
+    target = Config.PROXY_CACHE_MAX_BYTES * 0.9
+    for _, size, path in entries:
+        if total <= target:
+            break
+        try:
+            os.remove(path)
+            total -= size
+        except OSError:
+            pass
+    return total
+
+
+def _write_cached_image(clean, ct, content):
+    global _disk_cache_bytes
+    path = _image_cache_path(clean)
+    data = ct.encode('ascii', 'ignore') + b'\n' + content
+    try:
+        os.makedirs(Config.PROXY_CACHE_DIR, exist_ok=True)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        with _disk_cache_lock:
+            # Rescan (other processes write here too) once the running estimate passes the limit
+            if _disk_cache_bytes is None or _disk_cache_bytes + len(data) > Config.PROXY_CACHE_MAX_BYTES:
+                _disk_cache_bytes = _prune_disk_cache()
+            else:
+                _disk_cache_bytes += len(data)
+    except OSError as e:
+        print(f"Warning: Could not cache proxied image: {e}")
+
+
+# In-memory LRU of proxied images, bounded by total body size rather than entry count
+_image_memory_cache = OrderedDict()
+_image_memory_bytes = 0
+_image_memory_lock = threading.Lock()
+
+
+def _memory_cached_image(clean):
+    with _image_memory_lock:
+        cached = _image_memory_cache.get(clean)
+        if cached is not None:
+            _image_memory_cache.move_to_end(clean)
+        return cached
+
+
+def _memory_cache_image(clean, image):
+    global _image_memory_bytes
+    size = len(image[1])
+    if size > Config.PROXY_MEMORY_CACHE_MAX_ITEM_BYTES:
+        return
+    with _image_memory_lock:
+        if clean in _image_memory_cache:
+            return
+        _image_memory_cache[clean] = image
+        _image_memory_bytes += size
+        while _image_memory_bytes > Config.PROXY_MEMORY_CACHE_BYTES:
+            _, (_, evicted) = _image_memory_cache.popitem(last=False)
+            _image_memory_bytes -= len(evicted)
+
+
+def _fetch_image(clean):
+    """
+    Return (content_type, bytes) for an S3 key, from the memory or disk cache or storage.
+    Raises LookupError when no candidate URL serves an image (misses are not cached).
+    """
+    cached = _memory_cached_image(clean)
+    if cached:
+        return cached
+    cached = _read_cached_image(clean)
+    if cached:
+        _memory_cache_image(clean, cached)
+        return cached
+    
+    # If it's products/..., also try media/products/... (in the background, while the
+    # request thread tries as-is); if it's media/products/..., as-is is the only candidate
+    fallback = None
+    fallback_cancelled = threading.Event()
+    if clean.startswith('products/'):
+        fallback = _image_probe_pool.submit(
+            _probe_image, f'https://architectsdeclareapp.s3.amazonaws.com/media/{clean}',
+            _image_fallback_client, fallback_cancelled
+        )
+
+    # Try as-is, preferred over the fallback
+    try:
+        result = _probe_image(f'https://architectsdeclareapp.s3.amazonaws.com/{clean}')
+    except httpx.PoolTimeout:
+        fallback_cancelled.set()
+        raise
+    if result:
+        # Stops a fallback that is already running from downloading the rest of its body
+        fallback_cancelled.set()
+        if fallback:
+            fallback.cancel()
+    elif fallback:
+        result = fallback.result()
+    if not result:
+        raise LookupError(clean)
+
+    _write_cached_image(clean, *result)
+    _memory_cache_image(clean, result)
+    return result
+
+
 @app.get('/api/proxy-image')
 def proxy_image():
     """Proxy relative image paths to public storage so the UI can render images.
@@ -495,6 +804,7 @@ def proxy_image():
     Query:
       - path: relative path like "/products/Brand/file.jpg"
     Tries known bases and returns the first successful image response.
+    Images are cached in memory and under Config.PROXY_CACHE_DIR.
     """
     rel_path = request.args.get('path') or ''
     rel_path = rel_path.strip()
@@ -511,27 +821,14 @@ def proxy_image():
 
     # Decode percent-encoding to get the real S3 key
     clean = unquote(rel_path.lstrip('/'))
-    candidates = []
-    # Try as-is
-    candidates.append(f'https://architectsdeclareapp.s3.amazonaws.com/{clean}')
-    # If it's products/..., also try media/products/...
-    if clean.startswith('products/'):
-        candidates.append(f'https://architectsdeclareapp.s3.amazonaws.com/media/{clean}')
-    # If it's media/products/..., we already tried as-is
-
-    for url in candidates:
-        try:
-            with httpx.Client(follow_redirects=True, timeout=10) as client:
-                r = client.get(url)
-                if r.status_code == 200:
-                    ct = r.headers.get('content-type', 'application/octet-stream')
-                    if not ct.startswith('image/'):
-                        continue
-                    return Response(r.content, headers={'Content-Type': ct, 'Cache-Control': 'public, max-age=86400'})
-        except Exception:
-            continue
+    try:
+        ct, content = _fetch_image(clean)
+    except LookupError:
+        return jsonify({'error': 'Image not found'}), 404
+    except httpx.PoolTimeout:
+        return jsonify({'error': 'Image proxy busy'}), 503
 
-    return jsonify({'error': 'Image not found'}), 404
+    return Response(content, headers={'Content-Type': ct, 'Cache-Control': 'public, max-age=86400'})
 
 # -------- Serve built frontend (EPD Risk Scanner) via Flask only --------
 
@@ -546,8 +843,8 @@ def serve_epd_app(path='index.html'):
     if path.startswith('assets/'):
         return send_from_directory('static', path)
     
-    # Otherwise serve the index.html (React entry point)
-    return render_template('index.html')
+    # Otherwise serve the index.html (React entry point); it has no template variables
+    return send_from_directory(app.template_folder, 'index.html', max_age=60)
 
 
 
@@ -13,6 +13,12 @@ class Config:
     # OpenAI settings
     OPENAI_API_KEY = None
     EMBEDDING_MODEL = "text-embedding-3-small"
+    EMBEDDING_CONCURRENCY = 16  # Max concurrent embedding requests when indexing
+    EMBEDDING_MAX_RETRIES = 5  # Retries (with backoff) for rate-limited or failed embedding requests
+    # Embed on CPU with fastembed instead of the OpenAI API (needs the optional fastembed package).
+    # Switching modes re-embeds the catalog, since query and product vectors must share a model.
+    LOCAL_EMBEDDINGS = os.environ.get("LOCAL_EMBEDDINGS", "").lower() in ("1", "true", "yes")
+    LOCAL_EMBEDDING_MODEL = "BAAI/bge-small-en-v1.5"
     CHAT_MODEL = (
         "gpt-5-mini"  # Note: Newer models use max_completion_tokens (not max_tokens)
     )
@@ -28,10 +34,23 @@ class Config:
     TOP_K_SEMANTIC = 30  # Number of products from semantic search
     TOP_K_FINAL = 15  # Final number of products to return
     SIMILARITY_THRESHOLD = 0.3  # Minimum similarity score
+    QUERY_EMBEDDING_CACHE_SIZE = 4096  # Query embeddings kept in memory per search engine
+    EMBEDDING_QUERY_TIMEOUT = 30  # Seconds a search waits for its query embedding
+    ANN_MIN_PRODUCTS = 10000  # Build an HNSW index (needs the optional faiss package) at this catalog size
+    ANN_HNSW_M = 32  # HNSW graph neighbours per node
+    ANN_EF_CONSTRUCTION = 200  # HNSW build-time search depth
+    ANN_EF_SEARCH = 128  # HNSW query-time search depth (recall vs latency)
 
     # Cache settings
     CACHE_EMBEDDINGS = True
-    EMBEDDINGS_CACHE_FILE = os.path.join(BASE_DIR, "embeddings_cache.pkl")
+    EMBEDDINGS_CACHE_FILE = os.path.join(BASE_DIR, "embeddings_cache.npy")
+    EMBEDDINGS_CACHE_META_FILE = os.path.join(BASE_DIR, "embeddings_cache.meta.json")
+    ANN_INDEX_FILE = os.path.join(BASE_DIR, "embeddings_cache.faiss")  # Persisted HNSW index, recorded in the sidecar
+    LEGACY_EMBEDDINGS_CACHE_FILE = os.path.join(BASE_DIR, "embeddings_cache.pkl")  # Migrated to .npy on load
+    PROXY_CACHE_DIR = os.path.join(BASE_DIR, "cache", "proxy")
+    PROXY_CACHE_MAX_BYTES = 512 * 1024 * 1024  # Disk cache size; least recently used images are evicted past it
+    PROXY_MEMORY_CACHE_BYTES = 64 * 1024 * 1024  # Total image bytes kept in memory per process
+    PROXY_MEMORY_CACHE_MAX_ITEM_BYTES = 2 * 1024 * 1024  # Larger images are served from disk only
 
     # Database settings (for EPD Screener)
     SQLALCHEMY_DATABASE_URI = os.environ.get(
@@ -70,6 +89,11 @@ class Config:
 
         return None
 
+    @classmethod
+    def active_embedding_model(cls):
+        """Name of the model used for both product and query embeddings"""
+        return cls.LOCAL_EMBEDDING_MODEL if cls.LOCAL_EMBEDDINGS else cls.EMBEDDING_MODEL
+
     @classmethod
     def init_app(cls):
         """Initialize application configuration"""
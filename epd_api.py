@@ -10,28 +10,141 @@ from __future__ import annotations
 
 import csv
 import io
-import json
+import re
 from typing import Any, Dict, List
 
-from flask import Blueprint, jsonify, request, current_app, Response
+import orjson
+from flask import Blueprint, jsonify, request, current_app, Response, stream_with_context
 
 from db import db
 from models import Scan, ScanResult
-from rule_engine import evaluate_product
+from rule_engine import ADVISORY, REASONS, evaluate_products_batch
 
 
 epd_bp = Blueprint("epd", __name__, url_prefix="/api/epd")
 
 
-def _is_http_url(s: str) -> bool:
-    return isinstance(s, str) and s.lower().startswith(("http://", "https://"))
-
-
-def _is_image_url(s: str) -> bool:
-    if not isinstance(s, str):
-        return False
-    lowered = s.lower()
-    return lowered.endswith((".png", ".jpg", ".jpeg", ".webp", ".gif", ".bmp", ".svg"))
+# Keywords in product text that indicate a certificate (general / EPD-specific)
+GENERAL_KEYWORDS = (
+    "greentag",
+    "green tag",
+    "geca",
+    "greenguard",
+    "bifma",
+    "afrdi",
+    "cradle to cradle",
+    "c2c",
+    "declare",
+    "hpd",
+    "health product declaration",
+    "fsc",
+    "pefc",
+    "responsible wood",
+    "responsible steel",
+    "oeko-tex",
+    "scs indoor advantage",
+    "certificate",
+    "certified",
+    "certification",
+    "ecolabel",
+    "green rate",
+    "health rate",
+    "lca rate",
+)
+EPD_KEYWORDS = (
+    "epd",
+    "environmental product declaration",
+    "iso 14025",
+    "en 15804",
+    "ibu",
+    "epd australasia",
+    "epd international",
+    "environdec",
+)
+
+# Read buffer for uploaded CSV files
+_CSV_BUFFER_SIZE = 1 << 20
+
+# Product fields whose presence indicates a certificate
+_CERT_URL_FIELDS = (
+    "certificate_url",
+    "certification_url",
+    "green_tag_url",
+    "greentag_url",
+    "hpd_url",
+)
+# Product fields reported as certificate links in scan results
+_CERTIFICATE_LINK_FIELDS = _CERT_URL_FIELDS + ("hpd_certificate_url",)
+# Product text fields searched for certificate keywords
+_CERT_TEXT_FIELDS = (
+    "product_name",
+    "product_description",
+    "long_description",
+    "description",
+    "title",
+    "certifications_text",
+    "notes",
+)
+
+# Scan fields for ids that match no catalog product
+_EMPTY_SCAN_FIELDS: Dict[str, Any] = {
+    "has_certs": False,
+    "has_epd_cert": False,
+    "cert_names": (),
+    "certificate_urls": (),
+    "cat_names": (),
+    "thumbnail_url": None,
+}
+
+# Image candidate fields, in priority order
+_IMAGE_FIELDS = ("image", "image_url", "product_image", "main_image", "thumbnail", "photo")
+_IMAGE_ARRAY_FIELDS = ("images", "product_images", "gallery", "photos")
+_IMAGE_ENTRY_KEYS = ("url", "href", "src", "file", "image")
+
+# Image URL matchers; ASCII-only case folding matches the str.lower() checks on these literals
+_IMAGE_EXTENSIONS = r"\.(?:png|jpe?g|webp|gif|bmp|svg)"
+_HTTP_IMAGE_URL_RE = re.compile(
+    r"https?://.*" + _IMAGE_EXTENSIONS, re.IGNORECASE | re.ASCII | re.DOTALL
+)
+# Relative product paths: case-sensitive prefix, case-insensitive extension
+_REL_IMAGE_PATH_RE = re.compile(
+    r"/?(?:media/)?products/.*(?i:" + _IMAGE_EXTENSIONS + ")", re.ASCII | re.DOTALL
+)
+
+# Single-pass, case-insensitive keyword matchers (alternation compiled once)
+_GENERAL_RE = re.compile("|".join(re.escape(k) for k in GENERAL_KEYWORDS), re.IGNORECASE)
+_EPD_RE = re.compile("|".join(re.escape(k) for k in EPD_KEYWORDS), re.IGNORECASE)
+
+
+def _iter_image_candidates(product: Dict[str, Any]):
+    """Yield stripped non-empty image candidate strings in priority order."""
+
+    def from_array(arr: Any):
+        if not arr or not isinstance(arr, list):
+            return
+        for x in arr:
+            if isinstance(x, str):
+                yield x
+            elif isinstance(x, dict):
+                for k in _IMAGE_ENTRY_KEYS:
+                    yield x.get(k)
+
+    def values():
+        # Common single fields
+        for key in _IMAGE_FIELDS:
+            yield product.get(key)
+        # Common arrays and nested arrays
+        for key in _IMAGE_ARRAY_FIELDS:
+            yield from from_array(product.get(key))
+        media = product.get("media") or {}
+        yield from from_array(media.get("images"))
+        assets = product.get("assets") or {}
+        yield from from_array(assets.get("images"))
+        yield from from_array(product.get("attachments"))
+
+    for val in values():
+        if isinstance(val, str) and val.strip():
+            yield val.strip()
 
 
 def _extract_first_image_url(product: Dict[str, Any]) -> str | None:
@@ -39,65 +152,20 @@ def _extract_first_image_url(product: Dict[str, Any]) -> str | None:
     if not product:
         return None
 
-    candidates: list[str] = []
-
-    def push(val: Any):
-        if isinstance(val, str) and val.strip():
-            candidates.append(val.strip())
-
-    def extract_from_array(arr: Any):
-        if not arr:
-            return
-        if isinstance(arr, list):
-            for x in arr:
-                if isinstance(x, str):
-                    push(x)
-                elif isinstance(x, dict):
-                    for k in ("url", "href", "src", "file", "image"):
-                        v = x.get(k)
-                        push(v)
-
-    # Common single fields
-    for key in (
-        "image",
-        "image_url",
-        "product_image",
-        "main_image",
-        "thumbnail",
-        "photo",
-    ):
-        push(product.get(key))
-
-    # Common arrays and nested arrays
-    for key in (
-        "images",
-        "product_images",
-        "gallery",
-        "photos",
-    ):
-        extract_from_array(product.get(key))
-
-    media = product.get("media") or {}
-    extract_from_array(media.get("images"))
-    assets = product.get("assets") or {}
-    extract_from_array(assets.get("images"))
-    extract_from_array(product.get("attachments"))
-
-    # Pick the first usable candidate
-    for url in candidates:
-        if _is_http_url(url) and _is_image_url(url):
+    # Pick the first usable candidate, without collecting the rest
+    for url in _iter_image_candidates(product):
+        if _HTTP_IMAGE_URL_RE.fullmatch(url):
             return url
         # Relative S3-style product path
-        if isinstance(url, str) and url.startswith(("/products/", "products/", "/media/products/", "media/products/")) and _is_image_url(url):
+        if _REL_IMAGE_PATH_RE.fullmatch(url):
             rel = url if url.startswith("/") else f"/{url}"
             return f"/api/proxy-image?path={rel}"
 
     return None
 
 
-def _text_contains_any(text: str, keywords: list[str]) -> bool:
-    t = (text or "").lower()
-    return any(k in t for k in keywords)
+def _text_contains_any(text: str, pattern: re.Pattern[str]) -> bool:
+    return pattern.search(text or "") is not None
 
 
 def _detect_cert_state(product: Dict[str, Any]) -> tuple[bool, bool]:
@@ -108,6 +176,7 @@ def _detect_cert_state(product: Dict[str, Any]) -> tuple[bool, bool]:
     if not product:
         return False, False
 
+    # Cheap field checks first; the text scan only runs for undecided signals
     # 1) Direct boolean flag
     has_flag = bool(product.get("has_certifications"))
 
@@ -116,63 +185,16 @@ def _detect_cert_state(product: Dict[str, Any]) -> tuple[bool, bool]:
     has_array = bool(certs)
 
     # 3) Known URL fields indicating certificates
-    url_fields = [
-        "certificate_url",
-        "certification_url",
-        "green_tag_url",
-        "greentag_url",
-        "hpd_url",
-    ]
-    has_url = any(bool(product.get(f)) for f in url_fields)
+    has_any = has_flag or has_array or any(bool(product.get(f)) for f in _CERT_URL_FIELDS)
+
+    # EPD-specific also treat explicit epd_url as evidence
+    has_epd = bool(product.get("epd_url"))
+
+    if has_any and has_epd:
+        return True, True
 
     # 4) Textual keyword search across likely text fields
-    text_fields = [
-        "product_name",
-        "product_description",
-        "long_description",
-        "description",
-        "title",
-        "certifications_text",
-        "notes",
-    ]
-    combined_text = " ".join(str(product.get(f) or "") for f in text_fields)
-
-    general_keywords = [
-        "greentag",
-        "green tag",
-        "geca",
-        "greenguard",
-        "bifma",
-        "afrdi",
-        "cradle to cradle",
-        "c2c",
-        "declare",
-        "hpd",
-        "health product declaration",
-        "fsc",
-        "pefc",
-        "responsible wood",
-        "responsible steel",
-        "oeko-tex",
-        "scs indoor advantage",
-        "certificate",
-        "certified",
-        "certification",
-        "ecolabel",
-        "green rate",
-        "health rate",
-        "lca rate",
-    ]
-    epd_keywords = [
-        "epd",
-        "environmental product declaration",
-        "iso 14025",
-        "en 15804",
-        "ibu",
-        "epd australasia",
-        "epd international",
-        "environdec",
-    ]
+    combined_text = " ".join(str(product.get(f) or "") for f in _CERT_TEXT_FIELDS)
 
     # From certifications array names
     cert_names = []
@@ -181,49 +203,55 @@ def _detect_cert_state(product: Dict[str, Any]) -> tuple[bool, bool]:
         cert_names.append(str(name))
     names_text = " ".join(cert_names)
 
-    has_general_by_text = _text_contains_any(
-        combined_text, general_keywords
-    ) or _text_contains_any(names_text, general_keywords)
-    has_epd_by_text = _text_contains_any(
-        combined_text, epd_keywords
-    ) or _text_contains_any(names_text, epd_keywords)
-
-    has_any = has_flag or has_array or has_url or has_general_by_text
-
-    # EPD-specific also treat explicit epd_url as evidence
-    epd_url = product.get("epd_url")
-    has_epd = bool(epd_url) or has_epd_by_text
+    if not has_any:
+        has_any = _text_contains_any(
+            combined_text, _GENERAL_RE
+        ) or _text_contains_any(names_text, _GENERAL_RE)
+    if not has_epd:
+        has_epd = _text_contains_any(
+            combined_text, _EPD_RE
+        ) or _text_contains_any(names_text, _EPD_RE)
 
     return bool(has_any), bool(has_epd)
 
 
 def _normalize_ids_from_csv(file_storage) -> List[str]:
     """Parse CSV and extract product ids. Accepts columns: product_id, id, or first column."""
-    content = file_storage.read()
-    # Reset stream for safety (not strictly needed after read())
-    stream = io.StringIO(content.decode("utf-8", errors="ignore"))
+    raw = file_storage.stream
+    buffered = raw
+    if not isinstance(raw, io.BufferedIOBase):
+        buffered = io.BufferedReader(raw, buffer_size=_CSV_BUFFER_SIZE)
+    # Decode incrementally instead of materializing the whole upload
+    stream = io.TextIOWrapper(buffered, encoding="utf-8", errors="ignore", newline="")
+    try:
+        return _read_ids(stream)
+    finally:
+        # Detach so the wrappers don't close the request's file stream
+        stream.detach()
+        if buffered is not raw:
+            buffered.detach()
+
+
+def _read_ids(stream) -> List[str]:
     reader = csv.DictReader(stream)
     ids: List[str] = []
     if reader.fieldnames:
-        fieldnames_lower = [f.lower() for f in reader.fieldnames]
+        # Map lowercased header -> actual cased header (first occurrence wins)
+        lower_to_actual: Dict[str, str] = {}
+        for f in reader.fieldnames:
+            lower_to_actual.setdefault(f.lower(), f)
+        # Prefer explicit id columns, fall back to the first column
+        id_col = (
+            lower_to_actual.get("product_id")
+            or lower_to_actual.get("id")
+            or reader.fieldnames[0]
+        )
         for row in reader:
-            # Prefer explicit id columns
-            val = None
-            for key in ("product_id", "id"):
-                if key in fieldnames_lower:
-                    # Find actual cased key
-                    k = reader.fieldnames[fieldnames_lower.index(key)]
-                    val = (row.get(k) or "").strip()
-                    break
-            if val is None:
-                # Fallback: take first column value
-                first_key = reader.fieldnames[0]
-                val = (row.get(first_key) or "").strip()
+            val = (row.get(id_col) or "").strip()
             if val:
                 ids.append(val)
     else:
-        # No header: read simple lines
-        stream.seek(0)
+        # No header: the first row was empty, read the rest as simple lines
         for line in stream:
             line = line.strip()
             if line:
@@ -231,24 +259,80 @@ def _normalize_ids_from_csv(file_storage) -> List[str]:
     return ids
 
 
-def _find_product_by_id(product_id: str) -> Dict[str, Any] | None:
-    """Lookup product by multiple possible id fields."""
-    # Access the global indexer from app module
+def _get_indexer():
+    """Return the global indexer from the app module if products are loaded."""
     try:
         from app import indexer as global_indexer  # type: ignore
     except Exception:
-        global_indexer = None
+        return None
     if not global_indexer or not getattr(global_indexer, "products", None):
         return None
+    return global_indexer
 
-    target = str(product_id)
-    # Accept numeric or string id, and alternate keys
-    candidate_keys = ["id", "product_id", "sku", "code"]
-    for p in global_indexer.products:
-        for k in candidate_keys:
-            if k in p and str(p.get(k)) == target:
-                return p
-    return None
+
+def _find_product_by_id(product_id: str, indexer=None) -> Dict[str, Any] | None:
+    """Lookup product by multiple possible id fields."""
+    if indexer is None:
+        indexer = _get_indexer()
+    if indexer is None:
+        return None
+
+    # Accept numeric or string id, and alternate keys (id, product_id, sku, code)
+    return indexer.by_any_id.get(str(product_id))
+
+
+def _derive_scan_fields(product: Dict[str, Any]) -> Dict[str, Any]:
+    """Compute the scan result fields that depend only on the product."""
+    has_certs, has_epd_cert = _detect_cert_state(product)
+    # Collect certificate names (if present)
+    certs = product.get("certifications") or []
+    cert_names = []
+    for c in certs:
+        nm = c.get("certification") or c.get("name")
+        if nm:
+            cert_names.append(str(nm))
+    # Collect possible certificate URLs
+    certificate_urls: list[str] = []
+    for f in _CERTIFICATE_LINK_FIELDS:
+        v = product.get(f)
+        if v and str(v).strip():
+            certificate_urls.append(str(v).strip())
+    for c in certs:
+        for k in ("url", "link", "certificate_url"):
+            v = c.get(k)
+            if v and str(v).strip():
+                certificate_urls.append(str(v).strip())
+    # Collect category/type names
+    cats = product.get("product_categories") or []
+    cat_names = []
+    for cat in cats:
+        cn = cat.get("category_name") or cat.get("name")
+        if cn:
+            cat_names.append(str(cn))
+    return {
+        "has_certs": has_certs,
+        "has_epd_cert": has_epd_cert,
+        "cert_names": tuple(cert_names),
+        "certificate_urls": tuple(certificate_urls),
+        "cat_names": tuple(cat_names),
+        # Thumbnail image candidate
+        "thumbnail_url": _extract_first_image_url(product),
+    }
+
+
+def _scan_fields(product: Dict[str, Any], indexer=None) -> Dict[str, Any]:
+    """Derived scan fields for a product, memoized on the indexer per catalog product."""
+    if not product:
+        return _EMPTY_SCAN_FIELDS
+    cache = getattr(indexer, "scan_fields", None)
+    if cache is None:
+        return _derive_scan_fields(product)
+    # Keyed by object identity; the indexer keeps its products alive and
+    # resets the cache whenever its id index is rebuilt
+    fields = cache.get(id(product))
+    if fields is None:
+        fields = cache[id(product)] = _derive_scan_fields(product)
+    return fields
 
 
 @epd_bp.post("/scan")
@@ -286,89 +370,53 @@ def create_scan():
                 400,
             )
 
-    # Create Scan record
-    scan = Scan(source="local_index", input_count=len(product_ids))
-    db.session.add(scan)
-    db.session.flush()
-
-    high = med = low = 0
-    results_payload: List[dict] = []
+    # Repeated ids are evaluated once and their results reused
+    unique_ids = list(dict.fromkeys(product_ids))
+    indexer = _get_indexer()
+    products = [_find_product_by_id(pid, indexer) or {} for pid in unique_ids]
+    # Rule evaluation runs over the whole batch at once
+    reason_codes = evaluate_products_batch(products)
 
-    for pid in product_ids:
-        product = _find_product_by_id(pid) or {}
+    # pid -> (risk level, ScanResult column values, result payload)
+    per_id_result: Dict[str, tuple[str, dict, dict]] = {}
+    for pid, product, reason_code in zip(unique_ids, products, reason_codes.tolist()):
         epd_url = product.get("epd_url")
         epd_issue_date = product.get("epd_issue_date")
-        has_certs, has_epd_cert = _detect_cert_state(product)
-        # Collect certificate names (if present)
-        certs = product.get("certifications") or []
-        cert_names = []
-        for c in certs:
-            nm = c.get("certification") or c.get("name")
-            if nm:
-                cert_names.append(str(nm))
-        # Collect possible certificate URLs
-        certificate_urls: list[str] = []
-        known_url_fields = [
-            "certificate_url",
-            "certification_url",
-            "green_tag_url",
-            "greentag_url",
-            "hpd_url",
-            "hpd_certificate_url",
-        ]
-        for f in known_url_fields:
-            v = product.get(f)
-            if v and str(v).strip():
-                certificate_urls.append(str(v).strip())
-        for c in certs:
-            for k in ("url", "link", "certificate_url"):
-                v = c.get(k)
-                if v and str(v).strip():
-                    certificate_urls.append(str(v).strip())
-        # Collect category/type names
-        cats = product.get("product_categories") or []
-        cat_names = []
-        for cat in cats:
-            cn = cat.get("category_name") or cat.get("name")
-            if cn:
-                cat_names.append(str(cn))
-        # Thumbnail image candidate
-        thumb = _extract_first_image_url(product)
+        fields = _scan_fields(product, indexer)
+        has_certs = fields["has_certs"]
+        has_epd_cert = fields["has_epd_cert"]
 
-        base_risk, reasons, advisories = evaluate_product(product)
+        reasons = [REASONS[reason_code]]
+        advisories = [ADVISORY]
         # Certificate-based risk buckets:
         # - Green (Low): has EPD certificate
         # - Yellow (Medium): has certificates but not EPD
         # - Red (High): no certificates
         if has_epd_cert:
             risk_for_display = "Green"
-            low += 1
         elif has_certs:
             risk_for_display = "Yellow"
-            med += 1
         else:
             risk_for_display = "Red"
-            high += 1
 
         # Prefer robust fallbacks for names
         product_name = product.get("product_name") or product.get("name")
         manufacturer_name = product.get("manufacturer_name") or product.get("manufacturer")
 
-        sr = ScanResult(
-            scan_id=scan.id,
-            input_product_id=str(pid),
-            product_name=product_name,
-            manufacturer_name=manufacturer_name,
-            epd_url=epd_url,
-            epd_issue_date=epd_issue_date,
-            risk_level=risk_for_display,
-            reasons=json.dumps(reasons, ensure_ascii=False),
-            advisories=json.dumps(advisories, ensure_ascii=False),
-        )
-        db.session.add(sr)
-        results_payload.append(
+        per_id_result[pid] = (
+            risk_for_display,
+            {
+                "input_product_id": str(pid),
+                "product_name": product_name,
+                "manufacturer_name": manufacturer_name,
+                "epd_url": epd_url,
+                "epd_issue_date": epd_issue_date,
+                "risk_level": risk_for_display,
+                "reasons": orjson.dumps(reasons).decode(),
+                "advisories": orjson.dumps(advisories).decode(),
+            },
             {
-                "input_product_id": sr.input_product_id,
+                "input_product_id": str(pid),
                 "product_name": product_name,
                 "manufacturer_name": manufacturer_name,
                 "epd_url": epd_url,
@@ -377,18 +425,46 @@ def create_scan():
                 "has_epd": bool(epd_url and str(epd_url).strip()),
                 "has_certifications": has_certs,
                 "has_epd_certificate": has_epd_cert,
-                "certifications": cert_names,
-                "certificate_urls": certificate_urls,
-                "categories": cat_names,
-                "thumbnail_url": thumb,
+                "certifications": list(fields["cert_names"]),
+                "certificate_urls": list(fields["certificate_urls"]),
+                "categories": list(fields["cat_names"]),
+                "thumbnail_url": fields["thumbnail_url"],
                 "reasons": reasons,
                 "advisories": advisories,
-            }
+            },
         )
 
-    scan.high_risk_count = high
-    scan.medium_risk_count = med
-    scan.low_risk_count = low
+    # Results stay aligned with the input, one row per submitted id
+    high = med = low = 0
+    results_payload: List[dict] = []
+    # ScanResult column values (without scan_id), inserted in one executemany batch
+    sr_rows: List[dict] = []
+    for pid in product_ids:
+        risk_for_display, sr_row, payload = per_id_result[pid]
+        if risk_for_display == "Green":
+            low += 1
+        elif risk_for_display == "Yellow":
+            med += 1
+        else:
+            high += 1
+        sr_rows.append(sr_row)
+        results_payload.append(payload)
+
+    # All evaluation is done before touching the session: the Scan is inserted
+    # with its final counts, flushed once for its id, and committed with its rows
+    scan = Scan(
+        source="local_index",
+        input_count=len(product_ids),
+        high_risk_count=high,
+        medium_risk_count=med,
+        low_risk_count=low,
+    )
+    with db.session.no_autoflush:
+        db.session.add(scan)
+        db.session.flush()
+        db.session.bulk_insert_mappings(
+            ScanResult, [dict(row, scan_id=scan.id) for row in sr_rows]
+        )
     db.session.commit()
 
     summary = {
@@ -429,7 +505,7 @@ def get_scan(scan_id: int):
         if not txt:
             return []
         try:
-            return json.loads(txt)
+            return orjson.loads(txt)
         except Exception:
             return []
 
@@ -460,51 +536,62 @@ def get_scan(scan_id: int):
     return jsonify(payload)
 
 
-@epd_bp.get("/export/<int:scan_id>")
-def export_scan(scan_id: int):
-    fmt = (request.args.get("format") or "csv").lower()
-    scan = db.session.get(Scan, scan_id)
-    if not scan:
-        return jsonify({"error": "Scan not found"}), 404
-
+def _iter_scan_csv(scan_id: int):
+    """Yield a scan's results as UTF-8 CSV (with BOM), one encoded row at a time."""
+    output = io.StringIO()
+    writer = csv.writer(output)
+
+    def flush() -> bytes:
+        data = output.getvalue().encode("utf-8")
+        output.seek(0)
+        output.truncate()
+        return data
+
+    writer.writerow(
+        [
+            "input_product_id",
+            "product_name",
+            "manufacturer_name",
+            "epd_url",
+            "epd_issue_date",
+            "risk_level",
+            "reasons",
+            "advisories",
+        ]
+    )
+    yield b"\xef\xbb\xbf" + flush()
     results = (
         db.session.query(ScanResult)
-        .filter(ScanResult.scan_id == scan.id)
+        .filter(ScanResult.scan_id == scan_id)
         .order_by(ScanResult.id.asc())
-        .all()
+        .yield_per(1000)
     )
-
-    if fmt == "csv":
-        output = io.StringIO()
-        writer = csv.writer(output)
+    for r in results:
         writer.writerow(
             [
-                "input_product_id",
-                "product_name",
-                "manufacturer_name",
-                "epd_url",
-                "epd_issue_date",
-                "risk_level",
-                "reasons",
-                "advisories",
+                r.input_product_id,
+                r.product_name or "",
+                r.manufacturer_name or "",
+                r.epd_url or "",
+                r.epd_issue_date or "",
+                r.risk_level,
+                r.reasons or "[]",
+                r.advisories or "[]",
             ]
         )
-        for r in results:
-            writer.writerow(
-                [
-                    r.input_product_id,
-                    r.product_name or "",
-                    r.manufacturer_name or "",
-                    r.epd_url or "",
-                    r.epd_issue_date or "",
-                    r.risk_level,
-                    r.reasons or "[]",
-                    r.advisories or "[]",
-                ]
-            )
-        csv_bytes = output.getvalue().encode("utf-8-sig")
+        yield flush()
+
+
+@epd_bp.get("/export/<int:scan_id>")
+def export_scan(scan_id: int):
+    fmt = (request.args.get("format") or "csv").lower()
+    scan = db.session.get(Scan, scan_id)
+    if not scan:
+        return jsonify({"error": "Scan not found"}), 404
+
+    if fmt == "csv":
         return Response(
-            csv_bytes,
+            stream_with_context(_iter_scan_csv(scan.id)),
             headers={
                 "Content-Type": "text/csv; charset=utf-8",
                 "Content-Disposition": f"attachment; filename=epd_scan_{scan.id}.csv",
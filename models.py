@@ -29,7 +29,7 @@ class ScanResult(db.Model):
     __tablename__ = "scan_results"
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
-    scan_id: Mapped[int] = mapped_column(ForeignKey("scans.id"), nullable=False)
+    scan_id: Mapped[int] = mapped_column(ForeignKey("scans.id"), nullable=False, index=True)
 
     # Input identifiers
     input_product_id: Mapped[str] = mapped_column(String(128), nullable=False)
@@ -1,12 +1,27 @@
 """Product indexing and embedding generation"""
-import json
+import asyncio
+import hashlib
+import mmap
 import os
 import pickle
+import sys
+from collections.abc import Hashable
 import numpy as np
-from openai import OpenAI
+import orjson
+from openai import AsyncOpenAI, OpenAI
 from config import Config
 from prompts import get_product_embedding_text
 
+try:
+    import faiss
+except ImportError:  # Optional: semantic search falls back to an exact scan
+    faiss = None
+
+try:
+    from fastembed import TextEmbedding
+except ImportError:  # Optional: only needed with Config.LOCAL_EMBEDDINGS
+    TextEmbedding = None
+
 
 class ProductIndexer:
     """Handles product loading, embedding generation, and indexing"""
@@ -16,6 +31,18 @@ class ProductIndexer:
         self.client = OpenAI(api_key=self.api_key) if self.api_key else None
         self.products = []
         self.embeddings = None
+        # Approximate nearest-neighbour index over self.embeddings, built for large catalogs
+        self.ann_index = None
+        # Local embedding model (Config.LOCAL_EMBEDDINGS), loaded on first use and shared with the search engine
+        self._local_model = None
+        self.by_id = {}
+        self.by_any_id = {}
+        self.row_by_id = {}
+        # Per-product derived scan fields, filled lazily by the EPD scan API
+        self.scan_fields = {}
+        # Derived from the filter indexes; reset whenever they are rebuilt
+        self._filter_options_cache = None
+        self._statistics_cache = None
         self.filter_indexes = {
             'categories': {},
             'manufacturers': {},
@@ -31,16 +58,49 @@ class ProductIndexer:
             raise FileNotFoundError(f"Product data file not found: {file_path}")
         
         print(f"Loading products from {file_path}...")
-        with open(file_path, 'r', encoding='utf-8') as f:
-            self.products = json.load(f)
+        # Decode straight from the memory-mapped file: no intermediate str/bytes copy
+        with open(file_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            with memoryview(mm) as view:
+                self.products = orjson.loads(view)
+        self._intern_product_strings()
         
         print(f"Loaded {len(self.products)} products")
         self._build_filter_indexes()
         return self.products
     
+    def _intern_product_strings(self):
+        """
+        Intern top-level keys so lookups with literal keys match by identity, and
+        share one object per repeated manufacturer/category/certification name
+        """
+        intern = sys.intern
+        products = []
+        for product in self.products:
+            if not isinstance(product, dict):
+                products.append(product)
+                continue
+            product = {intern(key): value for key, value in product.items()}
+            manufacturer = product.get('manufacturer_name')
+            if isinstance(manufacturer, str):
+                product['manufacturer_name'] = intern(manufacturer)
+            for field, name_key in (('product_categories', 'category_name'), ('certifications', 'certification')):
+                entries = product.get(field)
+                if not isinstance(entries, list):
+                    continue
+                for entry in entries:
+                    if isinstance(entry, dict) and isinstance(entry.get(name_key), str):
+                        entry[name_key] = intern(entry[name_key])
+            products.append(product)
+        self.products = products
+    
     def _build_filter_indexes(self):
         """Build indexes for filtering"""
         print("Building filter indexes...")
+        self.filter_indexes['categories'] = {}
+        self.filter_indexes['manufacturers'] = {}
+        self.filter_indexes['certifications'] = set()
+        self._filter_options_cache = None
+        self._statistics_cache = None
         
         for product in self.products:
             # Category index
@@ -66,111 +126,418 @@ class ProductIndexer:
                 if cert_name:
                     self.filter_indexes['certifications'].add(cert_name)
         
+        # Finalize id lists as sorted int32 arrays: compact, and ready for np.intersect1d
+        for index_name in ('categories', 'manufacturers'):
+            index = self.filter_indexes[index_name]
+            for name, ids in index.items():
+                index[name] = np.sort(np.fromiter(ids, dtype=np.int32, count=len(ids)))
+        
         print(f"  - {len(self.filter_indexes['categories'])} categories")
         print(f"  - {len(self.filter_indexes['manufacturers'])} manufacturers")
         print(f"  - {len(self.filter_indexes['certifications'])} certification types")
+        
+        self._build_filter_columns()
+        self._build_id_index()
+    
+    def _build_id_index(self):
+        """
+        Build O(1) lookups: by_id/row_by_id for the primary id, and by_any_id
+        mapping every id-like field value (id, product_id, sku, code) to its product
+        """
+        self.by_id = {}
+        self.by_any_id = {}
+        self.row_by_id = {}
+        self.scan_fields = {}
+        for row, product in enumerate(self.products):
+            self.by_id.setdefault(product['id'], product)
+            self.row_by_id.setdefault(product['id'], row)
+            if product.get('id') is not None:
+                self.by_any_id.setdefault(str(product['id']), product)
+            for key in ('product_id', 'sku', 'code'):
+                value = product.get(key)
+                if value:
+                    self.by_any_id.setdefault(str(value), product)
+    
+    def _build_filter_columns(self):
+        """Build columnar (SoA) arrays so filters can be evaluated as NumPy masks"""
+        n = len(self.products)
+        self.manufacturer_codes = {}
+        self.mfr_codes = np.empty(n, dtype=np.int32)
+        self.has_cert = np.zeros(n, dtype=bool)
+        self.has_carbon = np.zeros(n, dtype=bool)
+        category_rows = {}
+        certification_rows = {}
+        
+        for row, product in enumerate(self.products):
+            manufacturer = product.get('manufacturer_name')
+            self.mfr_codes[row] = self.manufacturer_codes.setdefault(manufacturer, len(self.manufacturer_codes))
+            
+            certs = product.get('certifications') or []
+            self.has_cert[row] = bool(certs)
+            self.has_carbon[row] = bool(product.get('net_carbon_emissions'))
+            
+            # Products can belong to several categories/certifications, so keep row lists per name
+            for cat in product.get('product_categories') or []:
+                category_rows.setdefault(cat.get('category_name'), []).append(row)
+            for cert in certs:
+                certification_rows.setdefault(cert.get('certification'), []).append(row)
+        
+        self.category_rows = {name: np.array(rows, dtype=np.int32) for name, rows in category_rows.items()}
+        self.certification_rows = {name: np.array(rows, dtype=np.int32) for name, rows in certification_rows.items()}
+    
+    def _rows_mask(self, rows_by_name, names):
+        """Mask of products having at least one of the given names"""
+        mask = np.zeros(len(self.products), dtype=bool)
+        for name in names:
+            rows = rows_by_name.get(name)
+            if rows is not None:
+                mask[rows] = True
+        return mask
+    
+    @staticmethod
+    def _filter_names(value):
+        """Names from a filter value: a bare string is one name, unhashable entries match nothing"""
+        if not isinstance(value, (list, tuple, set, frozenset)):
+            value = (value,)
+        return [name for name in value if isinstance(name, Hashable)]
+    
+    def filter_mask(self, filters):
+        """
+        Evaluate filters over all products at once.
+        
+        filters may set 'categories', 'manufacturers' and 'certifications' (lists
+        of names; a product matches any of them) and the 'has_certifications'
+        and 'has_carbon_data' flags. Returns a boolean array aligned with
+        self.products.
+        """
+        mask = np.ones(len(self.products), dtype=bool)
+        if not filters:
+            return mask
+        
+        if filters.get('categories'):
+            mask &= self._rows_mask(self.category_rows, self._filter_names(filters['categories']))
+        
+        if filters.get('manufacturers'):
+            # Lookup table over manufacturer codes: one gather instead of np.isin's sort
+            wanted = np.zeros(len(self.manufacturer_codes), dtype=bool)
+            manufacturer_codes = self.manufacturer_codes
+            wanted[[manufacturer_codes[m] for m in self._filter_names(filters['manufacturers']) if m in manufacturer_codes]] = True
+            mask &= wanted[self.mfr_codes]
+        
+        if filters.get('certifications'):
+            mask &= self._rows_mask(self.certification_rows, self._filter_names(filters['certifications']))
+        
+        if filters.get('has_certifications'):
+            mask &= self.has_cert
+        
+        if filters.get('has_carbon_data'):
+            mask &= self.has_carbon
+        
+        return mask
     
     def generate_embeddings(self, force_regenerate=False):
-        """Generate embeddings for all products"""
-        cache_file = Config.EMBEDDINGS_CACHE_FILE
+        """Generate embeddings for all products, reusing cached ones whose text is unchanged"""
+        texts = [get_product_embedding_text(p) for p in self.products]
+        text_hashes = [self._text_hash(text) for text in texts]
+        reusable = {}
         
         # Try to load from cache
-        if not force_regenerate and Config.CACHE_EMBEDDINGS and os.path.exists(cache_file):
-            print(f"Loading embeddings from cache: {cache_file}")
-            try:
-                with open(cache_file, 'rb') as f:
-                    cache_data = pickle.load(f)
-                    if len(cache_data['embeddings']) == len(self.products):
-                        self.embeddings = cache_data['embeddings']
-                        print(f"Loaded {len(self.embeddings)} embeddings from cache")
-                        return self.embeddings
-            except Exception as e:
-                print(f"Failed to load cache: {e}")
-        
-        # Generate embeddings
-        if not self.client:
+        if not force_regenerate and Config.CACHE_EMBEDDINGS:
+            embeddings, cached_hashes = self._load_cached_embeddings()
+            if embeddings is None and not Config.LOCAL_EMBEDDINGS:
+                embeddings = self._migrate_legacy_cache(text_hashes)
+                cached_hashes = text_hashes
+            if embeddings is not None:
+                if cached_hashes is None:
+                    # Caches written before text hashes were recorded only match on product count
+                    current = len(embeddings) == len(self.products)
+                else:
+                    current = cached_hashes == text_hashes
+                if current:
+                    self.embeddings = embeddings
+                    print(f"Loaded {len(self.embeddings)} embeddings from cache")
+                    self._build_ann_index(text_hashes)
+                    return self.embeddings
+                reusable = dict(zip(cached_hashes or (), embeddings))
+        
+        # Only products whose embedding text changed need a new embedding
+        missing = [i for i, text_hash in enumerate(text_hashes) if text_hash not in reusable]
+        if missing and not self.client and not Config.LOCAL_EMBEDDINGS:
             raise ValueError("OpenAI client not initialized. Please provide API key.")
         
-        print(f"Generating embeddings for {len(self.products)} products...")
-        print("This may take a few minutes...")
+        if reusable:
+            print(f"Reusing {len(self.products) - len(missing)} cached embeddings for unchanged products")
+        if missing:
+            print(f"Generating embeddings for {len(missing)} products...")
+            print("This may take a few minutes...")
         
-        embeddings_list = []
         batch_size = 100
+        batches = [
+            [texts[i] for i in missing[j:j+batch_size]]
+            for j in range(0, len(missing), batch_size)
+        ]
         
-        for i in range(0, len(self.products), batch_size):
-            batch = self.products[i:i+batch_size]
-            batch_texts = [get_product_embedding_text(p) for p in batch]
-            
-            # Call OpenAI API
-            response = self.client.embeddings.create(
-                model=Config.EMBEDDING_MODEL,
-                input=batch_texts
-            )
-            
-            batch_embeddings = [item.embedding for item in response.data]
-            embeddings_list.extend(batch_embeddings)
-            
-            print(f"  Generated {len(embeddings_list)}/{len(self.products)} embeddings")
+        if not batches:
+            embeddings_list = []
+        elif Config.LOCAL_EMBEDDINGS:
+            model = self.local_embedding_model()
+            embeddings_list = [embedding for batch in batches for embedding in model.embed(batch)]
+        else:
+            # Batches are independent network calls, so issue them concurrently
+            batch_embeddings = asyncio.run(self._embed_batches(batches))
+            embeddings_list = [embedding for batch in batch_embeddings for embedding in batch]
         
-        self.embeddings = np.array(embeddings_list)
+        # New embeddings come back in the order of `missing`
+        new_embeddings = iter(embeddings_list)
+        self.embeddings = self._normalize_embeddings([
+            reusable[text_hash] if text_hash in reusable else next(new_embeddings)
+            for text_hash in text_hashes
+        ])
         
         # Cache the embeddings
         if Config.CACHE_EMBEDDINGS:
-            print(f"Caching embeddings to {cache_file}")
-            with open(cache_file, 'wb') as f:
-                pickle.dump({
-                    'embeddings': self.embeddings,
-                    'product_count': len(self.products)
-                }, f)
+            self._save_embeddings_cache(self.embeddings, text_hashes)
         
         print(f"Embeddings generated: shape {self.embeddings.shape}")
+        self._build_ann_index(text_hashes)
         return self.embeddings
     
+    def _build_ann_index(self, text_hashes):
+        """
+        Set up an HNSW inner-product index when faiss is installed and the catalog
+        is large enough, loading the persisted one if it was built from the same
+        embeddings and settings.
+        """
+        self.ann_index = None
+        if faiss is None or self.embeddings is None or len(self.embeddings) < Config.ANN_MIN_PRODUCTS:
+            return
+        # What the persisted index must have been built from to be reused
+        ann_meta = {
+            'model': Config.active_embedding_model(),
+            'product_count': len(self.embeddings),
+            'text_hashes': hashlib.blake2b(''.join(text_hashes).encode(), digest_size=16).hexdigest(),
+            'hnsw_m': Config.ANN_HNSW_M,
+            'ef_construction': Config.ANN_EF_CONSTRUCTION
+        }
+        index = self._load_ann_index(ann_meta) if Config.CACHE_EMBEDDINGS else None
+        if index is None:
+            print(f"Building HNSW index over {len(self.embeddings)} embeddings...")
+            # Rows are L2-normalized, so inner product is cosine similarity
+            index = faiss.IndexHNSWFlat(self.embeddings.shape[1], Config.ANN_HNSW_M, faiss.METRIC_INNER_PRODUCT)
+            index.hnsw.efConstruction = Config.ANN_EF_CONSTRUCTION
+            index.add(np.ascontiguousarray(self.embeddings, dtype=np.float32))
+            if Config.CACHE_EMBEDDINGS:
+                try:
+                    self._save_ann_index(index, ann_meta)
+                except OSError as e:
+                    print(f"Failed to write HNSW index: {e}")
+        index.hnsw.efSearch = Config.ANN_EF_SEARCH
+        self.ann_index = index
+    
+    def _load_ann_index(self, ann_meta):
+        """
+        Load the persisted HNSW index if the sidecar records it with ann_meta.
+        The graph is read fully into memory (faiss memory-maps only IVF and
+        flat-code storage), but loading skips the rebuild.
+        """
+        index_file = Config.ANN_INDEX_FILE
+        if not os.path.exists(index_file):
+            return None
+        try:
+            with open(Config.EMBEDDINGS_CACHE_META_FILE, 'rb') as f:
+                meta = orjson.loads(f.read())
+            if meta.get('ann_index') != ann_meta:
+                return None
+            print(f"Loading HNSW index from cache: {index_file}")
+            index = faiss.read_index(index_file)
+            if index.ntotal != ann_meta['product_count']:
+                return None
+            return index
+        except Exception as e:
+            print(f"Failed to load HNSW index: {e}")
+            return None
+    
+    def _save_ann_index(self, index, ann_meta):
+        """Write the HNSW index next to the .npy cache and record what it was built from in the sidecar"""
+        index_file = Config.ANN_INDEX_FILE
+        meta_file = Config.EMBEDDINGS_CACHE_META_FILE
+        print(f"Caching HNSW index to {index_file}")
+        with open(meta_file, 'rb') as f:
+            meta = orjson.loads(f.read())
+        tmp_file = f"{index_file}.tmp"
+        faiss.write_index(index, tmp_file)
+        os.replace(tmp_file, index_file)
+        meta['ann_index'] = ann_meta
+        tmp_meta = f"{meta_file}.tmp"
+        with open(tmp_meta, 'wb') as f:
+            f.write(orjson.dumps(meta))
+        os.replace(tmp_meta, meta_file)
+    
+    def _load_cached_embeddings(self):
+        """
+        Memory-map the .npy cache if it was built with the active model.
+        
+        Returns:
+            (embeddings, text hashes recorded in the sidecar or None), or (None, None)
+        """
+        cache_file = Config.EMBEDDINGS_CACHE_FILE
+        meta_file = Config.EMBEDDINGS_CACHE_META_FILE
+        if not (os.path.exists(cache_file) and os.path.exists(meta_file)):
+            return None, None
+        print(f"Loading embeddings from cache: {cache_file}")
+        try:
+            with open(meta_file, 'rb') as f:
+                meta = orjson.loads(f.read())
+            # Caches written before the model was recorded hold API embeddings
+            if meta.get('model', Config.EMBEDDING_MODEL) != Config.active_embedding_model():
+                return None, None
+            # Pages are read on demand and shared between forked workers
+            embeddings = np.load(cache_file, mmap_mode='r')
+            text_hashes = meta.get('text_hashes')
+            if len(embeddings) != meta.get('product_count') or (text_hashes is not None and len(text_hashes) != len(embeddings)):
+                return None, None
+            # Every search scans the whole matrix, so ask the kernel to start reading it ahead
+            mapping = getattr(embeddings, '_mmap', None)
+            if mapping is not None and hasattr(mmap, 'MADV_WILLNEED'):
+                mapping.madvise(mmap.MADV_WILLNEED)
+            return embeddings, text_hashes
+        except Exception as e:
+            print(f"Failed to load cache: {e}")
+            return None, None
+    
+    def _migrate_legacy_cache(self, text_hashes):
+        """Load a pickle cache from older versions and rewrite it as .npy"""
+        legacy_file = Config.LEGACY_EMBEDDINGS_CACHE_FILE
+        if not os.path.exists(legacy_file):
+            return None
+        print(f"Loading embeddings from legacy cache: {legacy_file}")
+        try:
+            with open(legacy_file, 'rb') as f:
+                cache_data = pickle.load(f)
+            if len(cache_data['embeddings']) != len(self.products):
+                return None
+            embeddings = self._normalize_embeddings(cache_data['embeddings'])
+        except Exception as e:
+            print(f"Failed to load cache: {e}")
+            return None
+        try:
+            self._save_embeddings_cache(embeddings, text_hashes)
+        except OSError as e:
+            print(f"Failed to write cache: {e}")
+        return embeddings
+    
+    def _save_embeddings_cache(self, embeddings, text_hashes):
+        """Write embeddings to the .npy cache plus a JSON sidecar with the product count, model and text hashes"""
+        cache_file = Config.EMBEDDINGS_CACHE_FILE
+        meta_file = Config.EMBEDDINGS_CACHE_META_FILE
+        print(f"Caching embeddings to {cache_file}")
+        # Write to temp files and rename, so a reader never maps a partial file
+        tmp_file = f"{cache_file}.tmp"
+        with open(tmp_file, 'wb') as f:
+            np.save(f, embeddings)
+        os.replace(tmp_file, cache_file)
+        tmp_meta = f"{meta_file}.tmp"
+        with open(tmp_meta, 'wb') as f:
+            f.write(orjson.dumps({
+                'product_count': len(embeddings),
+                'model': Config.active_embedding_model(),
+                'text_hashes': text_hashes
+            }))
+        os.replace(tmp_meta, meta_file)
+    
+    def local_embedding_model(self):
+        """The fastembed model for Config.LOCAL_EMBEDDINGS, loaded once"""
+        if self._local_model is None:
+            if TextEmbedding is None:
+                raise ValueError("Config.LOCAL_EMBEDDINGS requires the fastembed package")
+            self._local_model = TextEmbedding(model_name=Config.LOCAL_EMBEDDING_MODEL)
+        return self._local_model
+    
+    @staticmethod
+    def _text_hash(text):
+        """Cache key for an embedding text: products whose text is unchanged keep their embedding"""
+        return hashlib.blake2b(text.encode(), digest_size=16).hexdigest()
+    
+    @staticmethod
+    def _normalize_embeddings(embeddings):
+        """Return embeddings as a float32 matrix of unit-length rows, so cosine similarity is a dot product"""
+        embeddings = np.array(embeddings, dtype=np.float32)
+        if embeddings.ndim == 2 and len(embeddings):
+            embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True).clip(min=1e-12)
+        return embeddings
+    
+    async def _embed_batches(self, batches):
+        """Embed text batches concurrently, at most Config.EMBEDDING_CONCURRENCY in flight"""
+        # The client retries 429/5xx responses with exponential backoff, honouring Retry-After
+        client = AsyncOpenAI(api_key=self.api_key, max_retries=Config.EMBEDDING_MAX_RETRIES)
+        semaphore = asyncio.Semaphore(Config.EMBEDDING_CONCURRENCY)
+        total = sum(len(batch) for batch in batches)
+        done = 0
+        
+        async def embed(batch_texts):
+            nonlocal done
+            async with semaphore:
+                response = await client.embeddings.create(
+                    model=Config.EMBEDDING_MODEL,
+                    input=batch_texts
+                )
+            done += len(batch_texts)
+            print(f"  Generated {done}/{total} embeddings")
+            return [item.embedding for item in response.data]
+        
+        try:
+            # gather preserves batch order regardless of completion order
+            return await asyncio.gather(*(embed(batch) for batch in batches))
+        finally:
+            await client.close()
+    
     def get_filter_options(self):
-        """Get available filter options for the UI"""
+        """Get available filter options for the UI (computed once per catalog load)"""
+        if self._filter_options_cache is not None:
+            return self._filter_options_cache
+        
         # Get top manufacturers by product count
-        manufacturer_counts = [(name, len(ids)) for name, ids in self.filter_indexes['manufacturers'].items()]
+        manufacturer_counts = [(name, ids.size) for name, ids in self.filter_indexes['manufacturers'].items()]
         manufacturer_counts.sort(key=lambda x: x[1], reverse=True)
         
         # Get category counts
-        category_counts = [(name, len(ids)) for name, ids in self.filter_indexes['categories'].items()]
+        category_counts = [(name, ids.size) for name, ids in self.filter_indexes['categories'].items()]
         category_counts.sort(key=lambda x: x[1], reverse=True)
         
-        return {
+        self._filter_options_cache = {
             'categories': [{'name': name, 'count': count} for name, count in category_counts],
             'manufacturers': [{'name': name, 'count': count} for name, count in manufacturer_counts[:50]],  # Top 50
             'certifications': sorted(list(self.filter_indexes['certifications']))
         }
+        return self._filter_options_cache
     
     def get_product_by_id(self, product_id):
         """Get a product by ID"""
-        for product in self.products:
-            if product['id'] == product_id:
-                return product
-        return None
+        return self.by_id.get(product_id)
     
     def get_products_by_ids(self, product_ids):
-        """Get multiple products by IDs"""
-        id_set = set(product_ids)
-        return [p for p in self.products if p['id'] in id_set]
+        """Get multiple products by IDs, in request order with repeated IDs returned once"""
+        by_id = self.by_id
+        return [by_id[product_id] for product_id in dict.fromkeys(product_ids) if product_id in by_id]
     
     def get_statistics(self):
-        """Get product database statistics"""
-        total_products = len(self.products)
+        """Get product database statistics (computed once per catalog load)"""
+        if self._statistics_cache is not None:
+            return self._statistics_cache
         
-        # Count products with sustainability data
-        with_certifications = sum(1 for p in self.products if p.get('certifications'))
-        with_carbon_data = sum(1 for p in self.products if p.get('net_carbon_emissions'))
-        with_recycled_content = sum(1 for p in self.products if p.get('recycled_content_percentage'))
+        total_products = len(self.products)
         
-        # Get price range info
-        prices = []
+        # Count products with sustainability data in a single pass
+        with_certifications = with_carbon_data = with_recycled_content = 0
         for p in self.products:
-            price_str = p.get('price_adjustment_structure') or p.get('price_per_unit')
-            if price_str:
-                prices.append(price_str)
+            if p.get('certifications'):
+                with_certifications += 1
+            if p.get('net_carbon_emissions'):
+                with_carbon_data += 1
+            if p.get('recycled_content_percentage'):
+                with_recycled_content += 1
         
-        return {
+        self._statistics_cache = {
             'total_products': total_products,
             'total_categories': len(self.filter_indexes['categories']),
             'total_manufacturers': len(self.filter_indexes['manufacturers']),
@@ -186,4 +553,5 @@ class ProductIndexer:
                                 sorted(self.filter_indexes['manufacturers'].items(), 
                                       key=lambda x: len(x[1]), reverse=True)[:10]]
         }
+        return self._statistics_cache
 
@@ -1,80 +1,73 @@
 """AI prompt templates for product search and recommendations"""
 
+# (field, template) tables for get_product_embedding_text; a field is included when truthy
+_IDENTITY_FIELDS = (
+    ('manufacturer_name', 'Manufacturer: {}'),
+    ('product_name', 'Product: {}'),
+    ('product_code', 'Code: {}'),
+    ('product_description', 'Description: {}'),
+)
+_SUSTAINABILITY_FIELDS = (
+    ('recycled_content_percentage', 'Recycled content: {}%'),
+    ('recyclable_percentage', 'Recyclable: {}%'),
+    ('carbon_neutral', 'Carbon neutral'),
+    ('net_carbon_emissions', 'Carbon emissions: {} kg CO2e'),
+)
+_TECHNICAL_FIELDS = (
+    ('standard_dimensions', 'Dimensions: {}'),
+    ('expected_lifespan_years', 'Lifespan: {} years'),
+    ('manufacturers_warranty_years', 'Warranty: {} years'),
+)
+
+
+def _table_parts(product, fields):
+    return [template.format(value) for key, template in fields if (value := product.get(key))]
+
+
 def get_product_embedding_text(product):
     """
     Create a rich text representation of a product for embedding generation.
     Combines all relevant searchable features.
     """
-    parts = []
-    
-    # Core identity
-    if product.get('manufacturer_name'):
-        parts.append(f"Manufacturer: {product['manufacturer_name']}")
-    if product.get('product_name'):
-        parts.append(f"Product: {product['product_name']}")
-    if product.get('product_code'):
-        parts.append(f"Code: {product['product_code']}")
-    
-    # Description
-    if product.get('product_description'):
-        parts.append(f"Description: {product['product_description']}")
+    # Core identity and description
+    parts = _table_parts(product, _IDENTITY_FIELDS)
     
     # Categories
-    categories = product.get('product_categories', [])
-    if categories:
-        cat_names = [cat.get('category_name', '') for cat in categories if cat.get('category_name')]
+    if categories := product.get('product_categories', []):
+        cat_names = [name for cat in categories if (name := cat.get('category_name'))]
         if cat_names:
             parts.append(f"Categories: {', '.join(cat_names)}")
     
     # Sustainability profile
     sustainability_parts = []
     
-    certifications = product.get('certifications', [])
-    if certifications:
-        cert_names = [cert.get('certification', '') for cert in certifications if cert.get('certification')]
+    if certifications := product.get('certifications', []):
+        cert_names = [name for cert in certifications if (name := cert.get('certification'))]
         if cert_names:
             sustainability_parts.append(f"Certifications: {', '.join(cert_names)}")
     
-    if product.get('recycled_content_percentage'):
-        sustainability_parts.append(f"Recycled content: {product['recycled_content_percentage']}%")
-    if product.get('recyclable_percentage'):
-        sustainability_parts.append(f"Recyclable: {product['recyclable_percentage']}%")
-    if product.get('carbon_neutral'):
-        sustainability_parts.append("Carbon neutral")
-    if product.get('net_carbon_emissions'):
-        sustainability_parts.append(f"Carbon emissions: {product['net_carbon_emissions']} kg CO2e")
-    
+    sustainability_parts += _table_parts(product, _SUSTAINABILITY_FIELDS)
     if sustainability_parts:
         parts.append("Sustainability: " + "; ".join(sustainability_parts))
     
     # Technical attributes
-    tech_parts = []
-    if product.get('standard_dimensions'):
-        tech_parts.append(f"Dimensions: {product['standard_dimensions']}")
-    if product.get('expected_lifespan_years'):
-        tech_parts.append(f"Lifespan: {product['expected_lifespan_years']} years")
-    if product.get('manufacturers_warranty_years'):
-        tech_parts.append(f"Warranty: {product['manufacturers_warranty_years']} years")
-    
-    if tech_parts:
+    if tech_parts := _table_parts(product, _TECHNICAL_FIELDS):
         parts.append("Technical: " + "; ".join(tech_parts))
     
     # Commercial info
     commercial_parts = []
-    if product.get('price_adjustment_structure'):
-        commercial_parts.append(f"Price: {product['price_adjustment_structure']}")
-    elif product.get('price_per_unit'):
-        commercial_parts.append(f"Price: {product['price_per_unit']}")
-    if product.get('lead_time'):
-        commercial_parts.append(f"Lead time: {product['lead_time']}")
+    if price := product.get('price_adjustment_structure') or product.get('price_per_unit'):
+        commercial_parts.append(f"Price: {price}")
+    if lead_time := product.get('lead_time'):
+        commercial_parts.append(f"Lead time: {lead_time}")
     
     if commercial_parts:
         parts.append("Commercial: " + "; ".join(commercial_parts))
     
     # Safety & compliance
     safety_parts = []
-    if product.get('volatile_organic_compounds'):
-        safety_parts.append(f"VOC: {product['volatile_organic_compounds']}")
+    if voc := product.get('volatile_organic_compounds'):
+        safety_parts.append(f"VOC: {voc}")
     if product.get('substances_of_concern') == 'No':
         safety_parts.append("No substances of concern")
     
@@ -95,28 +88,29 @@ def get_search_refinement_prompt(query, products):
     Returns:
         Prompt string for LLM
     """
-    products_text = ""
+    parts = []
     for i, prod in enumerate(products, 1):
-        products_text += f"\n{i}. [Product ID: {prod.get('id')}] {prod.get('manufacturer_name', 'Unknown')} - {prod.get('product_name', 'Unknown')}\n"
+        parts.append(f"\n{i}. [Product ID: {prod.get('id')}] {prod.get('manufacturer_name', 'Unknown')} - {prod.get('product_name', 'Unknown')}\n")
         if prod.get('product_description'):
-            products_text += f"   Description: {prod['product_description']}\n"
+            parts.append(f"   Description: {prod['product_description']}\n")
         
         # Add key distinguishing features
         categories = prod.get('product_categories', [])
         if categories:
             cat_names = [c.get('category_name', '') for c in categories if c.get('category_name')]
             if cat_names:
-                products_text += f"   Categories: {', '.join(cat_names)}\n"
+                parts.append(f"   Categories: {', '.join(cat_names)}\n")
         
         # Sustainability highlights
         if prod.get('certifications'):
             cert_count = len(prod['certifications'])
-            products_text += f"   Certifications: {cert_count} certification(s)\n"
+            parts.append(f"   Certifications: {cert_count} certification(s)\n")
         
         if prod.get('price_adjustment_structure'):
-            products_text += f"   Price: {prod['price_adjustment_structure']}\n"
+            parts.append(f"   Price: {prod['price_adjustment_structure']}\n")
         
-        products_text += f"   Similarity Score: {prod.get('similarity_score', 0):.3f}\n"
+        parts.append(f"   Similarity Score: {prod.get('similarity_score', 0):.3f}\n")
+    products_text = "".join(parts)
     
     prompt = f"""You are an expert product recommendation system for architectural and building materials. 
 
@@ -160,19 +154,20 @@ def get_chat_response_prompt(query, products, chat_history=None):
     Returns:
         Prompt string for conversational LLM
     """
-    history_text = ""
+    history_parts = []
     if chat_history:
         for msg in chat_history[-6:]:  # Last 3 exchanges
             role = msg.get('role', 'user')
             content = msg.get('content', '')
-            history_text += f"\n{role.upper()}: {content}\n"
+            history_parts.append(f"\n{role.upper()}: {content}\n")
+    history_text = "".join(history_parts)
     
-    products_summary = ""
+    parts = []
     for i, prod in enumerate(products[:10], 1):
-        products_summary += f"\n{i}. **{prod.get('manufacturer_name', 'Unknown')} - {prod.get('product_name', 'Unknown')}** (ID: {prod.get('id')})\n"
+        parts.append(f"\n{i}. **{prod.get('manufacturer_name', 'Unknown')} - {prod.get('product_name', 'Unknown')}** (ID: {prod.get('id')})\n")
         if prod.get('product_description'):
             desc = prod['product_description'][:200] + "..." if len(prod.get('product_description', '')) > 200 else prod.get('product_description', '')
-            products_summary += f"   {desc}\n"
+            parts.append(f"   {desc}\n")
         
         # Key features including pricing
         features = []
@@ -197,7 +192,8 @@ def get_chat_response_prompt(query, products, chat_history=None):
             features.append(f"Lead time: {prod['lead_time']}")
         
         if features:
-            products_summary += f"   {' | '.join(features)}\n"
+            parts.append(f"   {' | '.join(features)}\n")
+    products_summary = "".join(parts)
     
     prompt = f"""You are a knowledgeable assistant helping architects and designers find building products and materials.
 
@@ -9,7 +9,22 @@ Final label consolidation prefers highest risk of triggered checks.
 
 from __future__ import annotations
 
-from typing import Any, Dict, List, Tuple
+from typing import Any, Dict, List, Sequence, Tuple
+
+import numpy as np
+
+# Reason code -> message, in the order the rules are checked (see _reason_codes)
+REASONS: Tuple[str, ...] = (
+    "Missing EPD file link",
+    "EPD link is relative and issue date is missing",
+    "EPD link is a relative path and may be inaccessible",
+    "EPD issue date is missing; validity cannot be verified",
+    "EPD link is accessible; please verify the issue date manually",
+)
+# Reason code -> risk level
+REASON_RISK_LEVELS: Tuple[str, ...] = ("Red", "Yellow", "Yellow", "Yellow", "Green")
+
+ADVISORY = "Please manually verify the validity period of all EPDs"
 
 
 def _is_absolute_url(url: str) -> bool:
@@ -17,44 +32,51 @@ def _is_absolute_url(url: str) -> bool:
     return lowered.startswith("http://") or lowered.startswith("https://")
 
 
+def _epd_flags(product: Dict[str, Any]) -> Tuple[bool, bool, bool]:
+    """Return (has_url, is_absolute, has_issue_date) for the fields the rules read."""
+    epd_url = product.get("epd_url") or None
+    epd_issue_date = product.get("epd_issue_date") or None
+
+    if not epd_url or (isinstance(epd_url, str) and not epd_url.strip()):
+        return False, False, False
+    return (
+        True,
+        _is_absolute_url(epd_url),
+        bool(epd_issue_date and str(epd_issue_date).strip()),
+    )
+
+
+def _reason_codes(has_url: np.ndarray, is_abs: np.ndarray, has_date: np.ndarray) -> np.ndarray:
+    """Apply the rules to flag arrays (or scalars); the first rule that fires picks the reason code."""
+    return np.select(
+        [~has_url, ~is_abs & ~has_date, ~is_abs, ~has_date],
+        [0, 1, 2, 3],
+        default=4,
+    ).astype(np.int8)
+
+
+def evaluate_products_batch(products: Sequence[Dict[str, Any]]) -> np.ndarray:
+    """Evaluate many products at once.
+
+    Each rule is a boolean mask over the whole batch. Returns reason codes
+    aligned with products; index REASONS and REASON_RISK_LEVELS with them.
+    Every product gets ADVISORY.
+    """
+    flags = np.array([_epd_flags(p) for p in products], dtype=bool).reshape(-1, 3)
+    return _reason_codes(flags[:, 0], flags[:, 1], flags[:, 2])
+
+
 def evaluate_product(product: Dict[str, Any]) -> Tuple[str, List[str], List[str]]:
     """Evaluate a single product and return (risk_level, reasons, advisories).
 
     Product is expected to have optional keys: 'epd_url', 'epd_issue_date'.
     Missing keys are treated as None.
     """
-    reasons: List[str] = []
-    advisories: List[str] = []
-
-    epd_url = product.get("epd_url") or None
-    epd_issue_date = product.get("epd_issue_date") or None
-
-    # Step 1: EPD existence
-    if not epd_url or (isinstance(epd_url, str) and not epd_url.strip()):
-        reasons.append("Missing EPD file link")
-        risk_level = "Red"
-        # Still advise manual verification generally
-        advisories.append("Please manually verify the validity period of all EPDs")
-    else:
-        is_abs = _is_absolute_url(epd_url)
-        has_issue_date = bool(epd_issue_date and str(epd_issue_date).strip())
-
-        if not is_abs and not has_issue_date:
-            risk_level = "Yellow"
-            reasons.append("EPD link is relative and issue date is missing")
-        elif not is_abs:
-            risk_level = "Yellow"
-            reasons.append("EPD link is a relative path and may be inaccessible")
-        elif not has_issue_date:
-            risk_level = "Yellow"
-            reasons.append("EPD issue date is missing; validity cannot be verified")
-        else:
-            risk_level = "Green"
-            reasons.append(
-                "EPD link is accessible; please verify the issue date manually"
-            )
-
-        advisories.append("Please manually verify the validity period of all EPDs")
+    code = int(_reason_codes(*np.array(_epd_flags(product), dtype=bool)))
+    risk_level = REASON_RISK_LEVELS[code]
+    reasons: List[str] = [REASONS[code]]
+    # Validity is never checked automatically, so every product gets the manual-verification advisory
+    advisories: List[str] = [ADVISORY]
 
     # Future extension (commented):
     # If epd_issue_date exists and >5 years, escalate to Red.
@@ -1,10 +1,103 @@
 """Hybrid search engine combining semantic search and LLM reasoning"""
-import numpy as np
 import json
+import queue
+import re
+import threading
+import traceback
+from concurrent.futures import Future
+from functools import lru_cache
+import numpy as np
+import orjson
 from openai import OpenAI
 from config import Config
 from prompts import get_search_refinement_prompt, get_chat_response_prompt
 
+# Phrases that mark a query as a follow-up on previously mentioned products
+FOLLOW_UP_KEYWORDS = ('pricing', 'price', 'cost', 'ballpark', 'tell me more', 'compare',
+                      'difference', 'which one', 'suggestions', 'recommendations',
+                      'you mentioned', 'you suggested', 'above', 'these', 'those')
+# One scan for all keywords; matched as substrings of the lowercased query, like the original `in` checks
+FOLLOW_UP_RE = re.compile('|'.join(re.escape(keyword) for keyword in FOLLOW_UP_KEYWORDS))
+# Product references in assistant replies, e.g. (ID: 1221)
+PRODUCT_ID_RE = re.compile(r'\(ID:\s*(\d+)\)')
+# JSON array of objects (or an empty array) in an LLM reply, from the first '[{' to the last '}]'
+JSON_ARRAY_RE = re.compile(r'\[\s*(?:\{.*\}\s*)?\]', re.DOTALL)
+# Filters matching at most this share of the catalog gather their rows before scoring; copying the
+# rows costs more than the skipped dot products once a filter keeps much more than this
+FILTER_GATHER_FRACTION = 0.125
+
+
+class BatchingEmbedder:
+    """
+    Coalesces concurrent single-text embedding requests into one API call.
+    
+    A worker thread sends whatever is queued as one batch (up to max_batch texts
+    per model). A lone request goes out immediately, and requests arriving while
+    a call is in flight are sent together in the next one. Callers wait at most
+    timeout seconds for their batch.
+    """
+    
+    def __init__(self, embed_batch, max_batch=64, timeout=None):
+        self.embed_batch = embed_batch  # (model, texts) -> list of embeddings, in order
+        self.max_batch = max_batch
+        self.timeout = timeout
+        self._pending = queue.Queue()
+        self._lock = threading.Lock()
+        self._worker = None
+    
+    def embed(self, model, text):
+        """Embed one text, blocking until its batch returns (TimeoutError after self.timeout)"""
+        future = Future()
+        self._pending.put((model, text, future))
+        self._ensure_worker()
+        return future.result(timeout=self.timeout)
+    
+    def _ensure_worker(self):
+        if self._worker is not None and self._worker.is_alive():
+            return
+        with self._lock:
+            # Also restarts after a fork, where the parent's thread does not exist
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, name='embedding-batcher', daemon=True)
+                self._worker.start()
+    
+    def _run(self):
+        while True:
+            batch = [self._pending.get()]
+            while len(batch) < self.max_batch:
+                try:
+                    batch.append(self._pending.get_nowait())
+                except queue.Empty:
+                    break
+            
+            try:
+                self._embed_pending(batch)
+            except BaseException as e:
+                # The worker is going down (the next embed() starts a new one); fail this
+                # batch rather than leave its callers waiting on futures nobody will resolve
+                error = RuntimeError(f"Embedding worker stopped: {e!r}")
+                for _, _, future in batch:
+                    if not future.done():
+                        future.set_exception(error)
+                raise
+    
+    def _embed_pending(self, batch):
+        """Resolve the futures of one dequeued batch, one embed_batch call per model"""
+        by_model = {}
+        for model, text, future in batch:
+            by_model.setdefault(model, []).append((text, future))
+        for model, items in by_model.items():
+            try:
+                embeddings = list(self.embed_batch(model, [text for text, _ in items]))
+                if len(embeddings) != len(items):
+                    raise ValueError(f"Embedding batch returned {len(embeddings)} rows for {len(items)} texts")
+            except Exception as e:
+                for _, future in items:
+                    future.set_exception(e)
+                continue
+            for (_, future), embedding in zip(items, embeddings):
+                future.set_result(embedding)
+
 
 class SearchEngine:
     """Hybrid search using embeddings + LLM refinement"""
@@ -13,6 +106,10 @@ class SearchEngine:
         self.indexer = indexer
         self.api_key = api_key or Config.OPENAI_API_KEY
         self.client = OpenAI(api_key=self.api_key) if self.api_key else None
+        # Concurrent queries share one embeddings request
+        self._embedder = BatchingEmbedder(self._embed_texts, timeout=Config.EMBEDDING_QUERY_TIMEOUT)
+        # Repeated queries (and chat follow-ups) reuse their embedding instead of another API round-trip
+        self._query_embedding = lru_cache(maxsize=Config.QUERY_EMBEDDING_CACHE_SIZE)(self._embed_query)
     
     def cosine_similarity(self, a, b):
         """Calculate cosine similarity between vectors"""
@@ -30,76 +127,162 @@ class SearchEngine:
         Returns:
             List of products with similarity scores
         """
+        products = self.indexer.products
+        results = []
+        for idx, similarity in self._semantic_matches(query, top_k, filters):
+            product_copy = products[idx].copy()
+            product_copy['similarity_score'] = similarity
+            results.append(product_copy)
+        return results
+    
+    def _semantic_matches(self, query, top_k=None, filters=None):
+        """
+        Rank products against a query without materializing them.
+        
+        Returns:
+            List of (product index, similarity score) pairs, best first
+        """
         top_k = top_k or Config.TOP_K_SEMANTIC
         
-        if not self.client:
+        if not self.client and not Config.LOCAL_EMBEDDINGS:
             raise ValueError("OpenAI client not initialized")
+        if self.indexer.embeddings is None:
+            raise ValueError("Product embeddings are not available")
         
-        # Generate query embedding
-        response = self.client.embeddings.create(
-            model=Config.EMBEDDING_MODEL,
-            input=[query]
-        )
-        query_embedding = np.array(response.data[0].embedding)
+        # Generate query embedding with the model the catalog was embedded with
+        query_embedding = self._query_embedding(Config.active_embedding_model(), query)
         
-        # Calculate similarities
-        similarities = []
-        for i, product_embedding in enumerate(self.indexer.embeddings):
-            similarity = self.cosine_similarity(query_embedding, product_embedding)
-            similarities.append((i, similarity))
+        if self.indexer.ann_index is not None:
+            matches = self._ann_matches(query_embedding, top_k, filters)
+            if matches is not None:
+                return matches
         
-        # Sort by similarity
-        similarities.sort(key=lambda x: x[1], reverse=True)
+        embeddings = self.indexer.embeddings
+        rows = None
+        if filters:
+            mask = self.indexer.filter_mask(filters)
+            if np.count_nonzero(mask) <= len(mask) * FILTER_GATHER_FRACTION:
+                # Selective filter: score only the matching rows
+                rows = np.flatnonzero(mask)
         
-        # Apply filters if provided
-        filtered_products = []
-        for idx, similarity in similarities:
-            if similarity < Config.SIMILARITY_THRESHOLD:
-                continue
-            
-            product = self.indexer.products[idx]
-            
-            # Apply filters
+        # Stored embeddings are L2-normalized, so one matrix-vector product yields every cosine similarity
+        if rows is not None:
+            similarities = embeddings[rows] @ query_embedding
+        else:
+            similarities = embeddings @ query_embedding
+            # Apply filters if provided: excluded products drop below any threshold before ranking
             if filters:
-                if not self._passes_filters(product, filters):
-                    continue
-            
-            product_copy = product.copy()
-            product_copy['similarity_score'] = float(similarity)
-            filtered_products.append(product_copy)
+                similarities[~mask] = -np.inf
+        
+        threshold = Config.SIMILARITY_THRESHOLD  # Read once, not per candidate
+        matches = []
+        for pos in self._ranked_indices(similarities, top_k):
+            similarity = float(similarities[pos])
+            if similarity < threshold:
+                # Descending order: every remaining product is below the threshold too
+                break
             
-            if len(filtered_products) >= top_k:
+            # rows is ascending, so ties keep catalog order as in the full scan
+            idx = int(rows[pos]) if rows is not None else pos
+            matches.append((idx, similarity))
+            if len(matches) >= top_k:
+                break
+        
+        return matches
+    
+    def _ann_matches(self, query_embedding, top_k, filters=None):
+        """
+        Top matches from the indexer's HNSW index, or None when the approximate
+        candidates cannot fill top_k and an exact scan is needed instead.
+        """
+        mask = self.indexer.filter_mask(filters) if filters else None
+        # Oversample so filter attrition rarely forces the exact fallback
+        k = min(top_k * 4 if filters else top_k, len(self.indexer.products))
+        scores, ids = self.indexer.ann_index.search(query_embedding.reshape(1, -1), k)
+        
+        threshold = Config.SIMILARITY_THRESHOLD
+        matches = []
+        for idx, similarity in zip(ids[0].tolist(), scores[0].tolist()):
+            if idx < 0 or similarity < threshold:
+                # Results are best first: the rest are padding or below the threshold
+                return matches
+            if mask is not None and not mask[idx]:
+                continue
+            matches.append((idx, similarity))
+            if len(matches) >= top_k:
+                return matches
+        
+        # Every candidate cleared the threshold, so more matches may exist beyond k
+        return matches if k >= len(self.indexer.products) else None
+    
+    def _embed_query(self, model, query):
+        """Request the L2-normalized embedding of a query (read-only, since it is shared through the cache)"""
+        query_embedding = np.asarray(self._embedder.embed(model, query), dtype=np.float32)
+        query_embedding /= max(np.linalg.norm(query_embedding), 1e-12)
+        query_embedding.flags.writeable = False
+        return query_embedding
+    
+    def _embed_texts(self, model, texts):
+        """Embed a batch of texts with one API call, or on CPU with the indexer's local model"""
+        if model == Config.LOCAL_EMBEDDING_MODEL:
+            return list(self.indexer.local_embedding_model().embed(texts))
+        response = self.client.embeddings.create(
+            model=model,
+            input=texts
+        )
+        return [item.embedding for item in response.data]
+    
+    def similar_products(self, product_idx, top_k=10):
+        """
+        Find products similar to the product at product_idx using its stored
+        embedding, so no query embedding has to be requested from the API.
+        
+        Returns:
+            List of products (excluding the product itself) with similarity scores
+        """
+        # Stored embeddings are L2-normalized, so dot products are cosine similarities
+        embeddings = self.indexer.embeddings
+        scores = embeddings @ embeddings[product_idx]
+        
+        threshold = Config.SIMILARITY_THRESHOLD
+        products = self.indexer.products
+        similar = []
+        # +1 for the product itself
+        for idx in self._ranked_indices(scores, top_k + 1):
+            if idx == product_idx:
+                continue
+            if scores[idx] < threshold:
+                break
+            product_copy = products[idx].copy()
+            product_copy['similarity_score'] = float(scores[idx])
+            similar.append(product_copy)
+            if len(similar) >= top_k:
                 break
         
-        return filtered_products
+        return similar
     
-    def _passes_filters(self, product, filters):
-        """Check if product passes all filters"""
-        # Category filter
-        if filters.get('categories'):
-            product_cats = [c.get('category_name') for c in product.get('product_categories', [])]
-            if not any(cat in filters['categories'] for cat in product_cats):
-                return False
-        
-        # Manufacturer filter
-        if filters.get('manufacturers'):
-            if product.get('manufacturer_name') not in filters['manufacturers']:
-                return False
-        
-        # Certification filter
-        if filters.get('certifications'):
-            product_certs = [c.get('certification') for c in product.get('certifications', [])]
-            if not any(cert in filters['certifications'] for cert in product_certs):
-                return False
-        
-        # Sustainability filter
-        if filters.get('has_certifications') and not product.get('certifications'):
-            return False
-        
-        if filters.get('has_carbon_data') and not product.get('net_carbon_emissions'):
-            return False
-        
-        return True
+    @staticmethod
+    def _ranked_indices(scores, k):
+        """
+        Yield indices of scores in descending order. The first k come from an
+        O(N) argpartition; only a caller that consumes more than k pays for a
+        full sort. Ties keep index order within each stage.
+        """
+        n = len(scores)
+        k = min(k, n)
+        if k <= 0:
+            return
+        if k < n:
+            top = np.sort(np.argpartition(-scores, k - 1)[:k])
+        else:
+            top = np.arange(n)
+        top = top[np.argsort(-scores[top], kind='stable')].tolist()
+        yield from top
+        if k < n:
+            seen = set(top)
+            for idx in np.argsort(-scores, kind='stable').tolist():
+                if idx not in seen:
+                    yield idx
     
     def llm_refine_results(self, query, products):
         """
@@ -135,16 +318,9 @@ class SearchEngine:
             # Parse JSON response
             content = response.choices[0].message.content.strip()
             
-            # Extract JSON if wrapped in markdown
-            if content.startswith("```"):
-                parts = content.split("```")
-                if len(parts) >= 2:
-                    content = parts[1]
-                    if content.startswith("json"):
-                        content = content[4:]
-                    content = content.strip()
-            
-            recommendations = json.loads(content)
+            # Extract the JSON array, whether bare or wrapped in a markdown fence
+            match = JSON_ARRAY_RE.search(content)
+            recommendations = orjson.loads(match.group(0) if match else content)
             
             # Map recommendations back to products
             product_map = {p['id']: p for p in products}
@@ -168,14 +344,13 @@ class SearchEngine:
             
             return refined_products[:Config.TOP_K_FINAL]
         
-        except json.JSONDecodeError as e:
+        except json.JSONDecodeError as e:  # orjson.JSONDecodeError subclasses it
             print(f"LLM refinement JSON parse error: {e}")
             print(f"LLM response content: {content[:200]}...")
             # Fallback to semantic search results
             return products[:Config.TOP_K_FINAL]
         except Exception as e:
             print(f"LLM refinement failed: {e}")
-            import traceback
             traceback.print_exc()
             # Fallback to semantic search results
             return products[:Config.TOP_K_FINAL]
@@ -221,55 +396,11 @@ class SearchEngine:
             return "AI chat is not available. Please configure OpenAI API key."
         
         try:
-            # Get relevant products from semantic search
-            products = self.semantic_search(query, top_k=max_products)
-            
-            # Extract product IDs from chat history for follow-up questions
-            previously_mentioned_ids = set()
-            if chat_history:
-                import re
-                for msg in chat_history[-6:]:  # Last 3 exchanges
-                    if msg.get('role') == 'assistant':
-                        content = msg.get('content', '')
-                        # Extract product IDs like (ID: 1221)
-                        ids = re.findall(r'\(ID:\s*(\d+)\)', content)
-                        previously_mentioned_ids.update(int(id_str) for id_str in ids)
-            
-            # If this looks like a follow-up question and we have previous IDs, include those products
-            follow_up_keywords = ['pricing', 'price', 'cost', 'ballpark', 'tell me more', 'compare', 
-                                  'difference', 'which one', 'suggestions', 'recommendations', 
-                                  'you mentioned', 'you suggested', 'above', 'these', 'those']
-            is_follow_up = any(keyword in query.lower() for keyword in follow_up_keywords)
-            
-            if is_follow_up and previously_mentioned_ids:
-                # Get the previously mentioned products
-                previous_products = self.indexer.get_products_by_ids(list(previously_mentioned_ids))
-                
-                # Merge with semantic search results, prioritizing previous products
-                product_ids_in_results = {p['id'] for p in products}
-                for prev_prod in previous_products:
-                    if prev_prod['id'] not in product_ids_in_results:
-                        products.insert(0, prev_prod)  # Add to beginning
-                
-                # Keep only max_products
-                products = products[:max_products]
-            
+            messages, products = self._prepare_products_and_prompt(query, chat_history, max_products)
             if not products:
                 return "I couldn't find any products matching your query. Could you try rephrasing or being more specific?"
             
-            # Generate chat prompt
-            prompt = get_chat_response_prompt(query, products, chat_history)
-            
             # Get LLM response
-            messages = [
-                {"role": "system", "content": "You are a helpful product expert for architectural and building materials."}
-            ]
-            
-            if chat_history:
-                messages.extend(chat_history[-6:])  # Last 3 exchanges
-            
-            messages.append({"role": "user", "content": prompt})
-            
             response = self.client.chat.completions.create(
                 model=Config.CHAT_MODEL,
                 messages=messages,
@@ -299,56 +430,12 @@ class SearchEngine:
             return
         
         try:
-            # Get relevant products from semantic search
-            products = self.semantic_search(query, top_k=max_products)
-            
-            # Extract product IDs from chat history for follow-up questions
-            previously_mentioned_ids = set()
-            if chat_history:
-                import re
-                for msg in chat_history[-6:]:  # Last 3 exchanges
-                    if msg.get('role') == 'assistant':
-                        content = msg.get('content', '')
-                        # Extract product IDs like (ID: 1221)
-                        ids = re.findall(r'\(ID:\s*(\d+)\)', content)
-                        previously_mentioned_ids.update(int(id_str) for id_str in ids)
-            
-            # If this looks like a follow-up question and we have previous IDs, include those products
-            follow_up_keywords = ['pricing', 'price', 'cost', 'ballpark', 'tell me more', 'compare', 
-                                  'difference', 'which one', 'suggestions', 'recommendations', 
-                                  'you mentioned', 'you suggested', 'above', 'these', 'those']
-            is_follow_up = any(keyword in query.lower() for keyword in follow_up_keywords)
-            
-            if is_follow_up and previously_mentioned_ids:
-                # Get the previously mentioned products
-                previous_products = self.indexer.get_products_by_ids(list(previously_mentioned_ids))
-                
-                # Merge with semantic search results, prioritizing previous products
-                product_ids_in_results = {p['id'] for p in products}
-                for prev_prod in previous_products:
-                    if prev_prod['id'] not in product_ids_in_results:
-                        products.insert(0, prev_prod)  # Add to beginning
-                
-                # Keep only max_products
-                products = products[:max_products]
-            
+            messages, products = self._prepare_products_and_prompt(query, chat_history, max_products)
             if not products:
                 yield "I couldn't find any products matching your query. Could you try rephrasing or being more specific?"
                 return
             
-            # Generate chat prompt
-            prompt = get_chat_response_prompt(query, products, chat_history)
-            
             # Get LLM response with streaming
-            messages = [
-                {"role": "system", "content": "You are a helpful product expert for architectural and building materials."}
-            ]
-            
-            if chat_history:
-                messages.extend(chat_history[-6:])
-            
-            messages.append({"role": "user", "content": prompt})
-            
             stream = self.client.chat.completions.create(
                 model=Config.CHAT_MODEL,
                 messages=messages,
@@ -363,4 +450,58 @@ class SearchEngine:
         except Exception as e:
             print(f"Stream chat error: {e}")
             yield f"I encountered an error processing your request. Please try again."
-
+    
+    def _prepare_products_and_prompt(self, query, chat_history, max_products):
+        """
+        Shared preamble of chat and stream_chat: find the products to discuss
+        (previously mentioned ones first for follow-up questions) and build the
+        message list for the chat model.
+        
+        Returns:
+            (messages, products), with messages None when no products were found
+        """
+        # Get relevant products from semantic search; the prompt only reads them, so skip the copies
+        catalog = self.indexer.products
+        products = [catalog[idx] for idx, _ in self._semantic_matches(query, top_k=max_products)]
+        
+        # Last 3 exchanges, sliced once for the ID scan, the prompt and the message list
+        recent = chat_history[-6:] if chat_history else []
+        
+        # Extract product IDs from chat history for follow-up questions
+        # Dict as an ordered set: IDs in the order they were first mentioned
+        previously_mentioned_ids = {}
+        for msg in recent:
+            if msg.get('role') == 'assistant':
+                content = msg.get('content', '')
+                # Extract product IDs like (ID: 1221)
+                for m in PRODUCT_ID_RE.finditer(content):
+                    previously_mentioned_ids.setdefault(int(m.group(1)))
+        
+        # If this looks like a follow-up question and we have previous IDs, include those products
+        is_follow_up = FOLLOW_UP_RE.search(query.lower()) is not None
+        
+        if is_follow_up and previously_mentioned_ids:
+            # Get the previously mentioned products
+            previous_products = self.indexer.get_products_by_ids(list(previously_mentioned_ids))
+            
+            # Merge with semantic search results in one pass, prioritizing previous products
+            merged = {prev_prod['id']: prev_prod for prev_prod in previous_products}
+            for product in products:
+                merged.setdefault(product['id'], product)
+            
+            # Keep only max_products
+            products = list(merged.values())[:max_products]
+        
+        if not products:
+            return None, products
+        
+        # Generate chat prompt
+        prompt = get_chat_response_prompt(query, products, recent)
+        
+        messages = [
+            {"role": "system", "content": "You are a helpful product expert for architectural and building materials."}
+        ]
+        
+        messages.extend(recent)
+        messages.append({"role": "user", "content": prompt})
+        return messages, products
@@ -0,0 +1,81 @@
+"""Persisted HNSW index: saved once, loaded on restart, rebuilt when stale (needs faiss)"""
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import product_indexer
+from config import Config
+from product_indexer import ProductIndexer
+
+
+@unittest.skipIf(product_indexer.faiss is None, 'faiss is not installed')
+class AnnIndexCacheTest(unittest.TestCase):
+    
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.tmp = tmp.name
+        for name, value in {
+            'CACHE_EMBEDDINGS': True,
+            'EMBEDDINGS_CACHE_FILE': os.path.join(self.tmp, 'embeddings.npy'),
+            'EMBEDDINGS_CACHE_META_FILE': os.path.join(self.tmp, 'embeddings.meta.json'),
+            'ANN_INDEX_FILE': os.path.join(self.tmp, 'embeddings.faiss'),
+            'LEGACY_EMBEDDINGS_CACHE_FILE': os.path.join(self.tmp, 'missing.pkl'),
+            'LOCAL_EMBEDDINGS': False,
+            'ANN_MIN_PRODUCTS': 50,
+        }.items():
+            patcher = mock.patch.object(Config, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        
+        self.products = [{'id': i, 'product_name': f'Product {i}'} for i in range(200)]
+        rng = np.random.default_rng(0)
+        self.vectors = rng.standard_normal((len(self.products), 16)).astype(np.float32)
+    
+    def _indexer(self, products=None):
+        indexer = ProductIndexer(api_key='test')
+        indexer.products = products or self.products
+        # Embeddings come from the fixed vectors, so no API is needed
+        indexer._embed_batches = self._fake_embed_batches
+        return indexer
+    
+    async def _fake_embed_batches(self, batches):
+        rows = iter(self.vectors)
+        return [[next(rows) for _ in batch] for batch in batches]
+    
+    def _search(self, indexer):
+        query = indexer.embeddings[7:8]
+        return indexer.ann_index.search(np.ascontiguousarray(query, dtype=np.float32), 5)[1].tolist()
+    
+    def test_index_is_loaded_from_disk_on_restart(self):
+        first = self._indexer()
+        first.generate_embeddings()
+        self.assertTrue(os.path.exists(Config.ANN_INDEX_FILE))
+        
+        second = self._indexer()
+        with mock.patch.object(product_indexer.faiss, 'IndexHNSWFlat') as build:
+            second.generate_embeddings()
+        build.assert_not_called()
+        self.assertEqual(second.ann_index.ntotal, len(self.products))
+        self.assertEqual(second.ann_index.hnsw.efSearch, Config.ANN_EF_SEARCH)
+        self.assertEqual(self._search(second), self._search(first))
+    
+    def test_index_is_rebuilt_when_settings_change(self):
+        self._indexer().generate_embeddings()
+        
+        with mock.patch.object(Config, 'ANN_HNSW_M', Config.ANN_HNSW_M // 2), \
+                mock.patch.object(product_indexer.faiss, 'read_index') as read:
+            indexer = self._indexer()
+            indexer.generate_embeddings()
+        read.assert_not_called()
+        self.assertEqual(indexer.ann_index.ntotal, len(self.products))
+
+
+if __name__ == '__main__':
+    unittest.main()